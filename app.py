@@ -2,30 +2,19 @@ import re
 from pathlib import Path
 from urllib.parse import urljoin
 
-from playwright.sync_api import sync_playwright
+from colormatch import DEFAULT_MATCHER, DEFAULT_TARGETS, KEYWORDS, _norm  # noqa: F401 (compatibilità)
+from imgmeta import rank_key, url_size_hint
+from scraper import _session, apply_cookies, stream_download, commit_download, rank_candidates
+from browser_scraper import (
+    ensure_login_state, _new_context, _swatch_snapshot, _wait_for_swatch_change, SWATCH_WAIT_MS, sync_playwright,
+)
 
 BASE = "https://www.innovativewear.com"
 
-KEYWORDS = {
-    "Black": ["black", "nero"],
-    "White": ["white", "bianco", "off white", "off-white", "ivory", "natural"],
-    "LightGrey": [
-        "sport grey", "sport gray",
-        "light oxford",
-        "grey heather", "gray heather",
-        "heather grey", "heather gray",
-        "ash",
-        "light grey", "light gray",
-        "silver",
-        "grey", "gray",
-    ],
-    "Red": ["red", "rosso", "cardinal", "crimson", "scarlet", "cherry", "burgundy"],
-    "Navy": ["navy", "dark navy", "midnight", "marine", "deep navy"],
-    "Royal": ["royal", "royal blue", "bright blue", "cobalt"],
-}
-
-def _norm(s: str) -> str:
-    return re.sub(r"\s+", " ", s.strip().lower())
+SEL_COLOR_LINKS = "a.js_colorswitch, a.colorSwitch, a[data-color][data-fid1]"
+SEL_LABEL = "p.colorLabel.js_searchable, p.colorLabel, .colorLabel"
+SEL_MAIN = "#js_productMainPhoto img, .wrapperFoto img, img.callToZoom"
+SEL_ZOOM_IMG = "#myZoomModal img, .modal img"
 
 def _clean_color_label(s: str) -> str:
     s = s.strip()
@@ -41,40 +30,35 @@ def _sanitize_filename(s: str) -> str:
     return s
 
 def _score(target: str, name: str) -> int:
-    n = _norm(name)
-    score = 0
-    for i, kw in enumerate(KEYWORDS.get(target, [])):
-        if kw in n:
-            score += 1000 - i * 10
-    # penalità “grigi scuri” quando cerchi grigio chiaro
-    if target == "LightGrey" and any(bad in n for bad in ["charcoal", "dark", "graphite", "dark heather"]):
-        score -= 250
-    return score
+    return DEFAULT_MATCHER.score(target, name)
 
 def _pick_best_for_target(target: str, available_names: list[str]) -> str | None:
-    ranked = sorted((( _score(target, n), n) for n in available_names), reverse=True, key=lambda x: x[0])
-    if not ranked:
-        return None
-    best_score, best_name = ranked[0]
-    return best_name if best_score > 0 else None
+    return DEFAULT_MATCHER.best_for(target, available_names)
 
 def _extract_size(url: str) -> tuple[int, int]:
-    m = re.search(r"(\d{2,5})x(\d{2,5})", url)
-    return (int(m.group(1)), int(m.group(2))) if m else (0, 0)
+    return url_size_hint(url)
 
-def _best_img_url(urls: set[str]) -> str | None:
+def _best_img_url(urls: set[str], session=None) -> str | None:
+    """
+    Con `session` i candidati vengono sondati (HEAD/GET parziale) e ordinati per dimensione
+    reale letta dall'header (imgmeta.rank_key); senza, solo per la dimensione nell'URL.
+    """
     if not urls:
         return None
     def rank(u: str):
-        w, h = _extract_size(u)
-        area = w * h
         bonus = 1 if "opt-" in u else 0
-        return (area, bonus, len(u))
-    return sorted(urls, key=rank, reverse=True)[0]
-
-def scrape_with_browser(url: str, out_dir: Path, username: str = "", password: str = "",
-                       targets: list[str] | None = None, try_hd: bool = True):
+        return (rank_key({"url": u}), bonus, len(u))
+    ordered = sorted(urls, key=rank, reverse=True)
+    if session is not None:
+        ordered = rank_candidates(session, ordered)
+    return ordered[0]
+
+def _scrape_targets_in_page(page, url: str, out_dir: Path, targets: list[str] | None = None,
+                            try_hd: bool = True, wait_ms: int = SWATCH_WAIT_MS, zoom_wait_ms: int = 600,
+                            matcher=None, sink=None, skip_codes=None):
     """
+    `skip_codes`: colori già completati (BrowserPool.map con manifest); qui la chiave è il
+    nome dello swatch scelto, perché i risultati a target non hanno codice colore.
     Ritorna:
     {
       "sku": "GLSF500",
@@ -84,47 +68,58 @@ def scrape_with_browser(url: str, out_dir: Path, username: str = "", password: s
       ]
     }
     """
-    targets = targets or ["Black", "White", "LightGrey", "Red", "Navy", "Royal"]
+    targets = targets or DEFAULT_TARGETS
+    matcher = matcher or DEFAULT_MATCHER
     out_dir = Path(out_dir)
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto(url, wait_until="domcontentloaded")
-        page.wait_for_timeout(800)
-
-        # Se serve login: (qui dipende dal sito; se il tuo vecchio scraper lo fa già, riusa quello)
-        # Se hai già flusso login funzionante, NON duplicarlo: integra qui.
-
-        # SKU
-        sku_el = page.locator("h2.prodCode, .prodCode").first
-        sku = _sanitize_filename(sku_el.inner_text().strip())
-
-        # Colori disponibili: titolo del link es. "Black (36)"
-        color_links = page.locator("a.js_colorswitch, a.colorSwitch, a[data-color][data-fid1]")
-        available = []
-        link_map = {}  # name -> nth index
-        for i in range(color_links.count()):
-            a = color_links.nth(i)
-            title = a.get_attribute("title") or ""
-            name = title.split("(")[0].strip() if title else ""
-            name = _clean_color_label(name)
-            if name and name not in link_map:
-                link_map[name] = i
-                available.append(name)
-
-        results = []
-
+    if sink is None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+    page.goto(url, wait_until="domcontentloaded")
+    try:
+        page.wait_for_selector(SEL_COLOR_LINKS, timeout=wait_ms)
+    except Exception:
+        pass
+
+    # Login: gestito dal context (storage_state salvato, vedi browser_scraper.ensure_login_state)
+
+    # SKU
+    sku_el = page.locator("h2.prodCode, .prodCode").first
+    sku = _sanitize_filename(sku_el.inner_text().strip())
+
+    # Colori disponibili: titolo del link es. "Black (36)"
+    color_links = page.locator(SEL_COLOR_LINKS)
+    available = []
+    link_map = {}  # name -> nth index
+    for i in range(color_links.count()):
+        a = color_links.nth(i)
+        title = a.get_attribute("title") or ""
+        name = title.split("(")[0].strip() if title else ""
+        name = _clean_color_label(name)
+        if name and name not in link_map:
+            link_map[name] = i
+            available.append(name)
+
+    results = []
+
+    skip_codes = set(skip_codes or ())
+    with _session() as session:
+        apply_cookies(session, page.context.cookies())
+
+        # un colore per target, ogni swatch al più a un target (colormatch.ColorMatcher.assign)
+        assignment = matcher.assign(targets, available)
         for target in targets:
-            chosen = _pick_best_for_target(target, available)
+            chosen = assignment[target]
             if not chosen:
                 results.append({"target": target, "color": None, "file": None, "img_url": None, "note": "No match"})
                 continue
+            if chosen in skip_codes:
+                continue  # già scaricato in un run precedente
 
-            # click colore
+            # click colore: si prosegue appena label o immagine principale cambiano
+            prev = _swatch_snapshot(page, SEL_LABEL, SEL_MAIN)
             color_links.nth(link_map[chosen]).click(force=True)
-            page.wait_for_timeout(1200)
+            if _clean_color_label(prev[0]) != chosen:
+                _wait_for_swatch_change(page, prev, timeout=wait_ms, label_sel=SEL_LABEL, img_sel=SEL_MAIN)
 
             # label colore selezionato (per naming reale)
             label = None
@@ -140,7 +135,7 @@ def scrape_with_browser(url: str, out_dir: Path, username: str = "", password: s
             # trova immagine migliore
             img_urls = set()
 
-            main_img = page.locator("#js_productMainPhoto img, .wrapperFoto img, img.callToZoom").first
+            main_img = page.locator(SEL_MAIN).first
             if main_img.count() > 0:
                 # url immagine corrente
                 src = main_img.get_attribute("src")
@@ -148,12 +143,13 @@ def scrape_with_browser(url: str, out_dir: Path, username: str = "", password: s
                     img_urls.add(urljoin(BASE, src))
 
                 if try_hd:
-                    # prova ad aprire zoom
-                    try:
-                        main_img.click(timeout=1500)
-                        page.wait_for_timeout(600)
-                    except:
-                        pass
+                    if page.locator(SEL_ZOOM_IMG).count() > 0:
+                        # prova ad aprire zoom (solo se la pagina ha il modal: altrimenti nessuna attesa)
+                        try:
+                            main_img.click(timeout=1500)
+                            page.wait_for_selector(SEL_ZOOM_IMG, state="visible", timeout=zoom_wait_ms)
+                        except Exception:
+                            pass
 
                     # raccogli possibili HD da modal/DOM
                     for sel in ["#myZoomModal img", ".modal img", "img[src*='opt-']", "a[href*='opt-']"]:
@@ -165,7 +161,7 @@ def scrape_with_browser(url: str, out_dir: Path, username: str = "", password: s
                                 if u and any(ext in u.lower() for ext in [".jpg", ".jpeg", ".png", ".webp"]):
                                     img_urls.add(urljoin(BASE, u))
 
-            best = _best_img_url(img_urls)
+            best = _best_img_url(img_urls, session)
             if not best:
                 results.append({"target": target, "color": label, "file": None, "img_url": None, "note": "No image"})
                 continue
@@ -179,15 +175,30 @@ def scrape_with_browser(url: str, out_dir: Path, username: str = "", password: s
             filename = f"{sku}_{label_safe}{ext}"
             out_path = out_dir / filename
 
-            # download via Playwright request
-            resp = page.request.get(best)
-            if not resp.ok:
-                results.append({"target": target, "color": label, "file": None, "img_url": best, "note": f"HTTP {resp.status}"})
+            # download in streaming (requests con i cookie del context): niente body intero in RAM
+            item = stream_download(session, best, sink.tmp_dir if sink is not None else out_dir)
+            if not item:
+                results.append({"target": target, "color": label, "file": None, "img_url": best, "note": "download failed"})
                 continue
 
-            out_path.write_bytes(resp.body())
+            if sink is not None:
+                # es. sinks.ZipSink: il file va dritto nell'archivio ("<out_dir>/<file>")
+                out_path = sink.put_download(item, f"{out_dir.name}/{filename}")
+            else:
+                commit_download(item, out_path)
 
             results.append({"target": target, "color": label, "file": str(out_path), "img_url": best})
 
+    return {"sku": sku, "results": results}
+
+def scrape_with_browser(url: str, out_dir: Path, username: str = "", password: str = "",
+                       targets: list[str] | None = None, try_hd: bool = True, lean=False, sink=None):
+    """Vedi `_scrape_targets_in_page`; per molti prodotti usare `browser_scraper.BrowserPool(handler=...)`."""
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        state = ensure_login_state(browser, username, password)
+        ctx = _new_context(browser, state, lean=lean)
+        page = ctx.new_page()
+        res = _scrape_targets_in_page(page, url, out_dir, targets=targets, try_hd=try_hd, sink=sink)
         browser.close()
-        return {"sku": sku, "results": results}
+        return res
@@ -0,0 +1,72 @@
+# bench_parse.py
+# Confronta i due estrattori di scraper.parse_page (BeautifulSoup vs lxml/XPath) su pagine
+# prodotto salvate: verifica che il `meta` sia identico e stampa i tempi medi.
+#
+#   python bench_parse.py pagine/*.html --repeat 20 --url https://www.innovativewear.com/prodotto
+#   python bench_parse.py --check      # solo equivalenza, sulle pagine di fixtures/pages
+
+import argparse, sys, time
+from pathlib import Path
+
+from scraper import _build_meta, _extract_bs4, _extract_lxml, parse_page
+
+FIXTURES = Path(__file__).with_name("fixtures") / "pages"
+
+def _time(html: str, url: str, fast: bool, repeat: int) -> tuple[float, dict]:
+    meta = None
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        meta, _doc = parse_page(None, url, html=html, fast=fast)
+    return (time.perf_counter() - t0) / repeat, meta
+
+def check(paths: list[Path], base_url: str) -> int:
+    """Esegue i due estrattori su ogni pagina e verifica che `_build_meta` dia lo stesso meta."""
+    failed = 0
+    for path in paths:
+        html = path.read_text(encoding="utf-8", errors="replace")
+        url = base_url.rstrip("/") + "/" + path.stem
+        m_bs4 = _build_meta(url, html, _extract_bs4(html)[0])
+        m_lxml = _build_meta(url, html, _extract_lxml(html)[0])
+        diff = [k for k in m_bs4 if m_bs4[k] != m_lxml.get(k)]
+        failed += bool(diff)
+        print(f"{path.name}: {'ok' if not diff else 'DIVERSO: ' + ', '.join(diff)}")
+    return 1 if failed else 0
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark estrattori di parse_page (bs4 vs lxml)")
+    ap.add_argument("fixtures", nargs="*", type=Path,
+                    help="file HTML di pagine prodotto salvate (default: fixtures/pages/*.html)")
+    ap.add_argument("--repeat", type=int, default=10)
+    ap.add_argument("--url", default="https://www.innovativewear.com/",
+                    help="URL base per risolvere i link relativi (e il fallback dello SKU)")
+    ap.add_argument("--check", action="store_true", help="solo verifica di equivalenza dei due estrattori")
+    args = ap.parse_args(argv)
+    args.fixtures = args.fixtures or sorted(FIXTURES.glob("*.html"))
+    if not args.fixtures:
+        ap.error(f"nessuna pagina in {FIXTURES}")
+    if args.check:
+        return check(args.fixtures, args.url)
+
+    mismatches = 0
+    tot_bs4 = tot_lxml = 0.0
+    print(f"{'file':40} {'KB':>7} {'bs4 ms':>9} {'lxml ms':>9} {'x':>6}")
+    for path in args.fixtures:
+        html = path.read_text(encoding="utf-8", errors="replace")
+        url = args.url.rstrip("/") + "/" + path.stem if args.url.endswith("/") else args.url
+        t_bs4, m_bs4 = _time(html, url, False, args.repeat)
+        t_lxml, m_lxml = _time(html, url, True, args.repeat)
+        tot_bs4 += t_bs4
+        tot_lxml += t_lxml
+        same = m_bs4 == m_lxml
+        if not same:
+            mismatches += 1
+            diff = [k for k in m_bs4 if m_bs4.get(k) != m_lxml.get(k)]
+            print(f"  ! meta diverso per {path.name}: {', '.join(diff)}", file=sys.stderr)
+        print(f"{path.name[:40]:40} {len(html) / 1024:7.0f} {t_bs4 * 1000:9.2f} {t_lxml * 1000:9.2f}"
+              f" {t_bs4 / t_lxml if t_lxml else 0:6.1f}{'' if same else '  DIFF'}")
+    if tot_lxml:
+        print(f"totale: bs4 {tot_bs4 * 1000:.1f} ms, lxml {tot_lxml * 1000:.1f} ms ({tot_bs4 / tot_lxml:.1f}x)")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
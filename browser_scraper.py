@@ -1,11 +1,17 @@
 # browser_scraper.py
 # Versione completa con: login, chiusura modale Best Price, cookie banner,
-# click sequenziale su tutti gli swatch con attesa immagine+label, salvataggio per colore.
+# click sugli swatch (in sequenza o ripartiti su più pagine) con attesa immagine+label, salvataggio per colore.
 
 from pathlib import Path
-import re, urllib.parse, time
-from playwright.sync_api import sync_playwright, TimeoutError as PWTimeout
-import requests
+import itertools, re, urllib.parse, time, socket, queue, threading, json, os, tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from ratelimit import DEFAULT_CONTROLLER
+from scraper import (
+    AUTH_STATE, DOWNLOAD_RE, ID_IN_QUERY_RE, apply_cookies, _session, stream_download, commit_download,
+    rank_candidates,
+)
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
@@ -17,6 +23,29 @@ SEL_COLOR_LABEL = "p.colorLabel.js_searchable"
 SEL_SWATCHES = "#js_availablecolorsheader .wrapperSwitchColore a.js_colorswitch"
 SEL_HD = "a.js_downloadPhoto[href*='product_photo_download']"
 
+IMG_URL_RE = re.compile(r"\.(?:jpe?g|png|webp)(?:\?|$)|product_photo_download", re.I)
+
+SWATCH_WAIT_MS = 8000  # tetto massimo di attesa per il cambio colore dopo un click
+SHARED_SRC_GRACE_MS = 1000  # label cambiata ma src fermo da tanto: stessa immagine per più colori
+
+# profilo "lean" (vedi `enable_lean_mode`): cosa viene bloccato con context.route
+LEAN_BLOCK_TYPES = ("font", "media", "manifest", "texttrack", "websocket", "eventsource")
+LEAN_FIRST_PARTY = ("innovativewear.com",)  # domini i cui script/CSS passano; None = nessun filtro
+LEAN_DENY = [
+    r"google-analytics|googletagmanager|gtag/js|doubleclick|googlesyndication",
+    r"facebook\.(?:net|com)|fbevents|hotjar|clarity\.ms|criteo|tiktok|bat\.bing",
+    r"best_?prices?",  # asset della modale Best Price
+]
+LEAN_ALLOW = [r"product_photo_download"]
+
+AUTH_MAX_AGE = 12 * 3600  # oltre questa età lo storage_state salvato viene rifatto
+_AUTH_LOCK = threading.Lock()
+
+def sync_playwright():
+    # Playwright si importa solo quando serve davvero un browser (avvio rapido di cli.py)
+    from playwright.sync_api import sync_playwright as _sync_playwright
+    return _sync_playwright()
+
 def filename_sanitize(name: str) -> str:
     name = re.sub(r"[\\/:*?\"<>|]+", "-", name).strip()
     name = re.sub(r"\s+", " ", name)
@@ -31,16 +60,6 @@ def guess_ext_from_bytes(data: bytes, default=".jpg") -> str:
         return ".webp"
     return default
 
-def try_download(url: str) -> bytes | None:
-    try:
-        r = requests.get(url, headers=HEADERS, timeout=45, allow_redirects=True)
-        ctype = r.headers.get("Content-Type","").lower()
-        if r.status_code == 200 and "text/html" not in ctype:
-            return r.content
-    except Exception:
-        return None
-    return None
-
 def _close_cookie_banner(page):
     selectors = [
         'button:has-text("Accetta")',
@@ -72,12 +91,57 @@ def _close_bestprice_modal(page):
             btn = page.locator(sel)
             if btn.count() > 0 and btn.first.is_visible():
                 btn.first.click(timeout=1500)
-                page.wait_for_timeout(400)
+                btn.first.wait_for(state="hidden", timeout=1500)
                 closed = True
         except Exception:
             pass
     return closed
 
+_SNAPSHOT_JS = """([labelSel, imgSel]) => {
+    const l = document.querySelector(labelSel), i = document.querySelector(imgSel);
+    return [l ? l.innerText : "", i ? (i.currentSrc || i.src || "") : ""];
+}"""
+
+_CHANGED_JS = """([labelSel, imgSel, prevLabel, prevSrc, graceMs, token]) => {
+    const l = document.querySelector(labelSel), i = document.querySelector(imgSel);
+    const label = l ? l.innerText : "", src = i ? (i.currentSrc || i.src || "") : "";
+    if (src !== prevSrc) return !i || (i.complete && i.naturalWidth > 0);
+    if (label === prevLabel) return false;
+    // cambiata solo la label: l'immagine è condivisa fra i colori solo se il src resta fermo per graceMs
+    const w = window.__swatchWait;
+    if (!w || w.token !== token) { window.__swatchWait = {token, at: performance.now()}; return false; }
+    return performance.now() - w.at >= graceMs;
+}"""
+
+_wait_tokens = itertools.count()  # un token per attesa: il timer della grace non passa da un click all'altro
+
+def _swatch_snapshot(page, label_sel: str = SEL_COLOR_LABEL, img_sel: str = SEL_MAIN_IMG):
+    """(testo label colore, src immagine principale) attuali, per rilevare il cambio colore."""
+    try:
+        return tuple(page.evaluate(_SNAPSHOT_JS, [label_sel, img_sel]))
+    except Exception:
+        return ("", "")
+
+def _wait_for_swatch_change(page, prev, timeout: int = SWATCH_WAIT_MS,
+                            label_sel: str = SEL_COLOR_LABEL, img_sel: str = SEL_MAIN_IMG) -> bool:
+    """
+    Attende che il src dell'immagine principale sia diverso da `prev` e che la nuova
+    immagine sia caricata; ritorna subito appena succede, False dopo `timeout` ms. Se
+    cambia solo la label, si accetta dopo SHARED_SRC_GRACE_MS senza cambio di src (foto
+    condivisa): così non si legge il src del colore precedente mentre il nuovo carica.
+    """
+    try:
+        page.wait_for_function(_CHANGED_JS, arg=[label_sel, img_sel, prev[0], prev[1], SHARED_SRC_GRACE_MS,
+                                                     next(_wait_tokens)],
+                               timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+def _same_color(label: str, swatch_title: str) -> bool:
+    norm = lambda s: re.sub(r"\s+", " ", s or "").strip().lower()
+    return bool(swatch_title) and norm(label) == norm(swatch_title)
+
 def _get_color_name_code(page):
     try:
         txt = page.locator(SEL_COLOR_LABEL).first.inner_text(timeout=2500)
@@ -120,141 +184,694 @@ def _do_login(page, username: str, password: str):
         page.wait_for_load_state("networkidle", timeout=12000)
         # chiudi eventuali banner post-login
         _close_cookie_banner(page)
-        for _ in range(3):
-            _close_bestprice_modal(page)
-            page.wait_for_timeout(200)
+        _close_bestprice_modal(page)
         return True
     except Exception:
         return False
 
-def scrape_with_browser(url: str, out_dir: Path, username: str = None, password: str = None):
-    out_dir.mkdir(parents=True, exist_ok=True)
-    results = []
+def _auth_state_is_fresh(path: Path, max_age: float = AUTH_MAX_AGE) -> bool:
+    try:
+        if time.time() - path.stat().st_mtime > max_age:
+            return False
+        cookies = json.loads(path.read_text(encoding="utf-8")).get("cookies", [])
+    except (OSError, ValueError):
+        return False
+    now = time.time()
+    # expires <= 0 -> cookie di sessione, valido finché non scade lo state
+    return bool(cookies) and all((c.get("expires") or -1) <= 0 or c["expires"] > now for c in cookies)
 
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        ctx = browser.new_context(
-            user_agent=HEADERS["User-Agent"],
-            viewport={"width": 1600, "height": 1000},
-        )
-        page = ctx.new_page()
+def ensure_login_state(browser, username: str = None, password: str = None,
+                       path: Path = AUTH_STATE, max_age: float = AUTH_MAX_AGE) -> Path | None:
+    """
+    Login una sola volta: salva lo storage_state (cookie + localStorage) in `path` e lo
+    riusa finché non è scaduto. Ritorna il path da passare a `new_context`, o None se
+    non c'è una sessione valida e mancano le credenziali / il login fallisce.
+    """
+    path = Path(path)
+    with _AUTH_LOCK:
+        if _auth_state_is_fresh(path, max_age):
+            return path
+        if not username or not password:
+            return None
+        ctx = _new_context(browser)
+        try:
+            page = ctx.new_page()
+            if not _do_login(page, username, password):
+                return None
+            path.parent.mkdir(parents=True, exist_ok=True)
+            ctx.storage_state(path=str(path))
+            return path
+        finally:
+            ctx.close()
 
-        # Login (se fornito)
-        _do_login(page, username, password)
+def enable_lean_mode(ctx, allow: list[str] = None, deny: list[str] = None,
+                     block_types=LEAN_BLOCK_TYPES, first_party=LEAN_FIRST_PARTY):
+    """
+    Profilo leggero: blocca (route.abort) font, media, analytics noti (LEAN_DENY) e le
+    richieste non-immagine di domini fuori da `first_party` (None: nessun filtro per
+    dominio). Le immagini passano da qualunque host: le foto prodotto possono stare su un
+    CDN e, se bloccate, ogni swatch aspetterebbe il timeout.
+    `allow` e `deny` sono regex aggiunte ai default (`allow` vince su tutto).
+    Nota: con una route attiva Chromium non usa la cache HTTP.
+    """
+    allow_re = re.compile("|".join(LEAN_ALLOW + list(allow or [])), re.I)
+    deny_re = re.compile("|".join(LEAN_DENY + list(deny or [])), re.I)
+    block_types = set(block_types)
 
-        # Vai alla pagina prodotto
-        page.goto(url, wait_until="domcontentloaded")
-        _close_cookie_banner(page)
-        for _ in range(3):
-            _close_bestprice_modal(page)
-            page.wait_for_timeout(150)
+    def handle(route):
+        req = route.request
+        url = req.url
+        if allow_re.search(url):
+            return route.continue_()
+        if deny_re.search(url) or req.resource_type in block_types:
+            return route.abort()  # anche i pixel di tracking, che sono "image"
+        if req.resource_type == "image" or not first_party:
+            return route.continue_()
+        host = (urllib.parse.urlsplit(url).hostname or "").lower()
+        if not any(host == d or host.endswith("." + d) for d in first_party):
+            return route.abort()
+        return route.continue_()
 
-        # SKU
-        try:
-            sku = (page.locator(SEL_SKU).first.text_content() or "").strip().upper()
-        except Exception:
-            sku = ""
-        if not sku:
-            sku = url.rstrip("/").split("/")[-1].upper()
+    ctx.route("**/*", handle)
+    return ctx
+
+def _new_context(browser, storage_state: Path | None = None, lean=False):
+    """`lean`: True per il profilo leggero di default, oppure un dict di opzioni per `enable_lean_mode`."""
+    ctx = browser.new_context(
+        user_agent=HEADERS["User-Agent"],
+        viewport={"width": 1600, "height": 1000},
+        storage_state=str(storage_state) if storage_state else None,
+    )
+    if lean:
+        enable_lean_mode(ctx, **(lean if isinstance(lean, dict) else {}))
+    return ctx
 
-        # Assicurati di avere main image & swatches
+class _ResponseRecorder:
+    """
+    Registra le risposte immagine / product_photo_download viste dalla pagina, così i
+    file si salvano dal traffico già fatto dal browser invece di riscaricarli.
+    """
+
+    def __init__(self, page):
+        self._page = page
+        self.responses = {}  # url -> Response (il body si legge solo se serve)
+        self.seen = []       # url in ordine di arrivo
+        page.on("response", self._on_response)
+
+    def _on_response(self, resp):
         try:
-            page.wait_for_selector(SEL_MAIN_IMG, timeout=8000)
-        except PWTimeout:
+            ctype = (resp.headers.get("content-type") or "").lower()
+            if resp.ok and (ctype.startswith("image/") or "product_photo_download" in resp.url):
+                if resp.url not in self.responses:
+                    self.seen.append(resp.url)
+                self.responses[resp.url] = resp
+        except Exception:
             pass
+
+    def mark(self) -> int:
+        return len(self.seen)
+
+    def since(self, mark: int) -> list[str]:
+        return self.seen[mark:]
+
+    def fetch(self, url: str) -> bytes | None:
+        resp = self.responses.get(url)
+        if resp is not None:
+            try:
+                return resp.body()
+            except Exception:
+                pass
+        # non ancora passata dalla pagina (es. link HD): la chiede il browser stesso, stessi cookie
         try:
-            page.wait_for_selector(SEL_SWATCHES, timeout=6000)
-        except PWTimeout:
+            with DEFAULT_CONTROLLER.slot(url) as slot:
+                r = self._page.request.get(url)
+                slot.record(r.status, r.headers.get("retry-after"))
+            if r.ok and "text/html" not in (r.headers.get("content-type") or "").lower():
+                return r.body()
+        except Exception:
             pass
+        return None
 
-        swatches = page.locator(SEL_SWATCHES)
-        count = swatches.count()
-        if count == 0:
-            count = 1  # fallback: singola immagine
+    def detach(self):
+        self._page.remove_listener("response", self._on_response)
 
-        seen_codes = set()
+_SWATCH_DATA_JS = """(sel) => Array.from(document.querySelectorAll(sel)).map(a => {
+    const d = {title: a.getAttribute("title") || a.innerText || ""};
+    for (const at of a.attributes) if (at.name.startsWith("data-")) d[at.name] = at.value;
+    return d;
+})"""
 
-        # --- ciclo sequenziale: clicca ogni swatch, aspetta aggiornamento, salva ---
-        for i in range(count):
-            # pulizia overlay ad ogni giro
-            for _ in range(2):
-                _close_bestprice_modal(page)
-                page.wait_for_timeout(150)
+def _embedded_color_map(page, url: str) -> list[dict] | None:
+    """
+    Colore -> link HD / immagine già presenti nella pagina: link product_photo_download con
+    id = data-fid1 dello swatch, oppure attributi data-* dello swatch che puntano a un'immagine.
+    None se anche un solo swatch non è risolvibile (allora serve il click).
+    """
+    try:
+        swatches = page.evaluate(_SWATCH_DATA_JS, SEL_SWATCHES)
+        html = page.content()
+    except Exception:
+        return None
+    if not swatches:
+        return None
+    id_to_link = {}
+    for m in DOWNLOAD_RE.finditer(html):
+        link = urllib.parse.urljoin(url, m.group("url"))
+        mid = ID_IN_QUERY_RE.search(link)
+        if mid:
+            id_to_link.setdefault(mid.group(1), link)
+    out = []
+    for i, d in enumerate(swatches):
+        txt = re.sub(r"\s+", " ", d.get("title") or "").strip()
+        m = re.search(r"(.+?)\s*\(([^)]+)\)", txt)
+        name, code = (m.group(1).strip(), m.group(2).strip()) if m else (txt, d.get("data-color"))
+        hd = id_to_link.get(d.get("data-fid1") or "")
+        img = next((urllib.parse.urljoin(url, v) for k, v in d.items()
+                    if k.startswith("data-") and v and IMG_URL_RE.search(v)), None)
+        if not hd and not img:
+            return None
+        out.append({"name": name or f"Color_{i+1}", "code": code or f"C{i+1}", "hd": hd, "img": img})
+    return out
 
-            # clic sullo swatch corrente (anche il primo)
-            if swatches.count() > 0:
-                a = swatches.nth(i)
-                try:
-                    _click_with_retries(a, attempts=3)
-                except Exception:
-                    try:
-                        page.evaluate("(el)=>el.click()", a)
-                    except Exception:
-                        pass
-                _close_bestprice_modal(page)
+def _write_image(out_dir: Path, base: str, data: bytes) -> str:
+    # scrittura su temporaneo + rename atomico, come per i download in streaming
+    fname = f"{base}{guess_ext_from_bytes(data)}"
+    fd, tmp = tempfile.mkstemp(dir=out_dir, prefix=".dl-", suffix=".part")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, out_dir / fname)
+    return fname
 
-            # attesa che label + main image siano disponibili/aggiornate
-            try:
-                page.wait_for_selector(SEL_COLOR_LABEL, timeout=8000)
-            except Exception:
-                pass
+def _scrape_in_page(page, url: str, out_dir: Path, wait_ms: int = SWATCH_WAIT_MS, intercept: bool = False,
+                    cache=None, skip_codes=None, shards: int = 1, sink=None, postprocess=None,
+                    only_codes=None):
+    """
+    Scraping di un prodotto in una pagina già aperta (context eventualmente già loggato).
+    Con `intercept=True` i file vengono salvati dalle risposte intercettate dal browser
+    (niente secondo download via requests) e, se la mappa colore -> immagine è già nella
+    pagina, gli swatch non vengono nemmeno cliccati. Con `cache` (image_cache.ImageCache)
+    i download sono condizionali e i file sono hardlink ai blob della cache.
+    I colori con codice in `skip_codes` (già completati, vedi manifest) non vengono salvati;
+    con `only_codes` si cliccano e salvano solo gli swatch con quei codici (vedi orchestrator.py).
+    Con `shards > 1` gli swatch vengono cliccati in parallelo su più pagine dello stesso
+    context (risultati comunque in ordine di swatch); con `intercept` si usa una sola pagina,
+    perché le risposte si registrano sulla pagina principale.
+    Con `sink` (sinks.py) i file vanno nel sink come "<nome di out_dir>/<file>".
+    Con `postprocess` (postprocess.Postprocessor) i file salvati vanno al pool di rendition
+    senza attendere: i Future sono in `res["_postprocess"]` (li attende chi consuma).
+    """
+    if sink is None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    recorder = _ResponseRecorder(page) if intercept else None
+    session = None
+    if recorder is None:
+        # download via requests con gli stessi cookie del context (login incluso)
+        session = _session()
+        apply_cookies(session, page.context.cookies())
+        if cache is None:
+            tmp_dir = sink.tmp_dir if sink is not None else out_dir
+            fetch = lambda u: stream_download(session, u, tmp_dir)
+        else:
+            fetch = lambda u: cache.fetch(session, u)
+        rank = lambda urls: rank_candidates(session, urls)
+    elif cache is None:
+        fetch = recorder.fetch
+    else:
+        def fetch(u):
+            data = recorder.fetch(u)
+            return cache.put(u, data) if data else None
+    if recorder is not None:
+        rank = lambda urls: urls  # HD prima: i body arrivano dal browser, niente probe
+
+    if sink is not None:
+        def save(base, item):
+            if isinstance(item, bytes):
+                name = f"{out_dir.name}/{base}{guess_ext_from_bytes(item)}"
+                return Path(sink.put_bytes(name, item)).name
+            return Path(sink.put_download(item, f"{out_dir.name}/{base}{item['ext']}")).name
+    elif cache is not None:
+        save = lambda base, info: cache.link_into(info, out_dir / f"{base}{info['ext']}").name
+    elif recorder is None:
+        save = lambda base, info: commit_download(info, out_dir / f"{base}{info['ext']}").name
+    else:
+        # body già in memoria (Playwright non espone le risposte in streaming)
+        save = lambda base, data: _write_image(out_dir, base, data)
+
+    try:
+        res = _scrape_swatches(page, url, out_dir, wait_ms, fetch, save, rank, recorder, skip_codes,
+                               shards=1 if recorder is not None else shards,
+                               only_codes=set(only_codes) if only_codes is not None else None)
+        if postprocess is not None and sink is None:
             try:
-                page.wait_for_selector(SEL_MAIN_IMG, timeout=8000)
-            except Exception:
-                pass
-            page.wait_for_timeout(800)  # piccolo buffer per JS
+                res["_postprocess"] = postprocess.submit_all(res["results"], out_dir)
+            except BrokenProcessPool as e:
+                res["renditions_error"] = f"{type(e).__name__}: {e}"  # file originali salvati comunque
+        return res
+    finally:
+        if recorder is not None:
+            recorder.detach()
+        if session is not None:
+            session.close()
 
-            # leggi nome/codice colore
-            color_name, color_code = _get_color_name_code(page)
-            if not color_name:
-                color_name = f"Color_{i+1}"
-            if not color_code:
-                color_code = f"C{i+1}"
+def _scrape_swatches(page, url: str, out_dir: Path, wait_ms: int, fetch, save, rank, recorder: _ResponseRecorder = None,
+                     skip_codes=None, shards: int = 1, only_codes=None):
+    from playwright.sync_api import TimeoutError as PWTimeout
+    results = []
 
-            if color_code in seen_codes:
-                continue
-            seen_codes.add(color_code)
+    # Vai alla pagina prodotto
+    page.goto(url, wait_until="domcontentloaded")
+    _close_cookie_banner(page)
+    _close_bestprice_modal(page)
 
-            # prova link HD (non blocca)
-            hd_url = None
-            try:
-                loc = page.locator(SEL_HD).first
-                if loc and loc.count() > 0:
-                    hd_url = loc.get_attribute("href")
-            except Exception:
-                hd_url = None
+    # SKU
+    try:
+        sku = (page.locator(SEL_SKU).first.text_content() or "").strip().upper()
+    except Exception:
+        sku = ""
+    if not sku:
+        sku = url.rstrip("/").split("/")[-1].upper()
 
-            if hd_url:
-                hd_abs = urllib.parse.urljoin(url, hd_url)
-                data = try_download(hd_abs)
+    # Assicurati di avere main image & swatches
+    try:
+        page.wait_for_selector(SEL_MAIN_IMG, timeout=8000)
+    except PWTimeout:
+        pass
+    try:
+        page.wait_for_selector(SEL_SWATCHES, timeout=6000)
+    except PWTimeout:
+        pass
+
+    swatches = page.locator(SEL_SWATCHES)
+    count = swatches.count()
+    if count == 0:
+        count = 1  # fallback: singola immagine
+
+    # mappa colori già nella pagina: niente click
+    cmap = _embedded_color_map(page, url) if recorder else None
+    if cmap:
+        for c in cmap:
+            if c["code"] in (skip_codes or ()) or (only_codes is not None and c["code"] not in only_codes):
+                continue
+            color = {"name": c["name"], "code": c["code"]}
+            for method, src in (("embedded_hd", c["hd"]), ("embedded_img", c["img"])):
+                data = fetch(src) if src else None
                 if data:
-                    ext = guess_ext_from_bytes(data)
-                    fname = f"{sku} - {filename_sanitize(color_name)} ({color_code}){ext}"
-                    (out_dir / fname).write_bytes(data)
-                    results.append({"method": "hd_link", "file": fname, "url": hd_abs, "color": {"name": color_name, "code": color_code}})
-                    continue
+                    fname = save(f"{sku} - {filename_sanitize(c['name'])} ({c['code']})", data)
+                    results.append({"method": method, "file": fname, "url": src, "color": color})
+                    break
+            else:
+                results.append({"method": "failed", "reason": "download failed", "url": c["hd"] or c["img"], "color": color})
+        return {"sku": sku, "results": results}
 
-            # fallback: main image corrente
+    seen_codes = set(skip_codes or ())
+    indices = list(range(count))
+    if only_codes is not None:
+        # solo gli swatch richiesti (codice dal title "Nome (COD)" / data-color, come parse_page);
+        # quelli senza codice leggibile si cliccano comunque e si filtrano dopo la lettura
+        codes = _swatch_codes(page)
+        indices = [i for i in indices if i >= len(codes) or codes[i] is None or codes[i] in only_codes]
+
+    # swatch distribuiti a turno su `shards` pagine dello stesso context: in ogni giro si
+    # clicca su tutte le pagine e poi si attende/legge ciascuna, così i caricamenti si
+    # sovrappongono. Tutto il lavoro Playwright resta su questo thread (API sync), quindi
+    # seen_codes non ha bisogno di lock; i download (requests) vanno in un pool di thread.
+    pages = [page] + [_open_shard(page, url) for _ in range(min(shards, len(indices)) - 1)]
+    slots = [None] * count  # risultati per indice di swatch
+    pool = ThreadPoolExecutor(max_workers=len(pages)) if len(pages) > 1 else None
+    try:
+        for start in range(0, len(indices), len(pages)):
+            batch = list(zip(pages, indices[start:start + len(pages)]))
+            clicked = []
+            for p, i in batch:
+                mark = recorder.mark() if recorder else 0
+                clicked.append((mark, _click_swatch(p, i)))
+            for (p, i), (mark, click) in zip(batch, clicked):
+                color, methods = _read_swatch(p, url, i, click, wait_ms)
+                if color["code"] in seen_codes or (only_codes is not None and color["code"] not in only_codes):
+                    continue
+                seen_codes.add(color["code"])
+                # url immagine / HD caricate dal browser dopo questo click
+                extra = {"responses": recorder.since(mark)} if recorder else {}
+                if not methods:
+                    slots[i] = {"method": "failed", "reason": "no main image", "color": color, **extra}
+                elif pool is not None:
+                    slots[i] = pool.submit(_download_swatch, sku, color, methods, fetch, save, rank, extra)
+                else:
+                    slots[i] = _download_swatch(sku, color, methods, fetch, save, rank, extra)
+        results.extend(r.result() if isinstance(r, Future) else r for r in slots if r is not None)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        for p in pages[1:]:
             try:
-                src = page.locator(SEL_MAIN_IMG).first.get_attribute("src")
+                p.close()
             except Exception:
-                src = None
-            if not src:
-                results.append({"method": "failed", "reason": "no main image", "color": {"name": color_name, "code": color_code}})
-                continue
+                pass
 
-            src_abs = urllib.parse.urljoin(url, src)
-            data = try_download(src_abs)
-            if not data:
-                results.append({"method": "failed", "reason": "download failed", "url": src_abs, "color": {"name": color_name, "code": color_code}})
-                continue
+    return {"sku": sku, "results": results}
+
+_SWATCH_CODES_JS = """(sel) => Array.from(document.querySelectorAll(sel)).map(
+    a => [a.getAttribute("title") || "", a.getAttribute("data-color") || ""])"""
+
+def _swatch_codes(page) -> list:
+    """Codice colore di ogni swatch letto senza cliccare (None se non ricavabile)."""
+    try:
+        pairs = page.evaluate(_SWATCH_CODES_JS, SEL_SWATCHES)
+    except Exception:
+        return []
+    codes = []
+    for title, data_color in pairs:
+        m = re.search(r"(.+?)\s*\(([^)]+)\)", title.strip())
+        codes.append(m.group(2).strip() if m else (data_color or None))
+    return codes
+
+def _open_shard(page, url: str):
+    """Altra pagina dello stesso context (stessi cookie/login) sullo stesso prodotto."""
+    from playwright.sync_api import TimeoutError as PWTimeout
+    p = page.context.new_page()
+    p.goto(url, wait_until="domcontentloaded")
+    _close_cookie_banner(p)
+    _close_bestprice_modal(p)
+    try:
+        p.wait_for_selector(SEL_SWATCHES, timeout=6000)
+    except PWTimeout:
+        pass
+    return p
+
+def _click_swatch(page, i: int):
+    """Clic sullo swatch `i` senza attendere il cambio; ritorna (snapshot precedente, title) o None."""
+    # pulizia overlay ad ogni giro (attende solo se la modale c'è davvero)
+    _close_bestprice_modal(page)
+    swatches = page.locator(SEL_SWATCHES)
+    if swatches.count() == 0:
+        return None
+    a = swatches.nth(i)
+    prev = _swatch_snapshot(page)
+    try:
+        title = a.get_attribute("title") or ""
+    except Exception:
+        title = ""
+    try:
+        _click_with_retries(a, attempts=3)
+    except Exception:
+        try:
+            page.evaluate("(el)=>el.click()", a)
+        except Exception:
+            pass
+    _close_bestprice_modal(page)
+    return prev, title
+
+def _read_swatch(page, url: str, i: int, click, wait_ms: int):
+    """Attende l'effetto del clic e legge colore + candidati {url: metodo} (link HD, main image)."""
+    if click is not None:
+        prev, title = click
+        # attesa a evento: label o immagine cambiano (salvo swatch già selezionato)
+        if not _same_color(prev[0], title):
+            _wait_for_swatch_change(page, prev, timeout=wait_ms)
+    else:
+        try:
+            page.wait_for_selector(SEL_COLOR_LABEL, timeout=wait_ms)
+        except Exception:
+            pass
+
+    # leggi nome/codice colore
+    color_name, color_code = _get_color_name_code(page)
+    color = {"name": color_name or f"Color_{i+1}", "code": color_code or f"C{i+1}"}
+
+    # prova link HD (non blocca)
+    hd_url = None
+    try:
+        loc = page.locator(SEL_HD).first
+        if loc and loc.count() > 0:
+            hd_url = loc.get_attribute("href")
+    except Exception:
+        hd_url = None
+
+    try:
+        src = page.locator(SEL_MAIN_IMG).first.get_attribute("src")
+    except Exception:
+        src = None
+    methods = {}
+    if hd_url:
+        methods.setdefault(urllib.parse.urljoin(url, hd_url), "hd_link")
+    if src:
+        methods.setdefault(urllib.parse.urljoin(url, src), "main")
+    return color, methods
+
+def _download_swatch(sku: str, color: dict, methods: dict, fetch, save, rank, extra: dict) -> dict:
+    # candidati: link HD + main image corrente, ordinati per dimensione reale
+    cands = list(methods)
+    for cand in (rank(cands) if len(cands) > 1 else cands):
+        data = fetch(cand)
+        if data:
+            fname = save(f"{sku} - {filename_sanitize(color['name'])} ({color['code']})", data)
+            return {"method": methods[cand], "file": fname, "url": cand, "color": color, **extra}
+    return {"method": "failed", "reason": "download failed", "url": cands[-1], "color": color, **extra}
+
+def scrape_with_browser(url: str, out_dir: Path, username: str = None, password: str = None,
+                        auth_state: Path = AUTH_STATE, wait_ms: int = SWATCH_WAIT_MS, intercept: bool = False,
+                        cache=None, lean=False, shards: int = 1, sink=None, postprocess=None):
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        # Login (se fornito) solo se non c'è già una sessione salvata valida
+        state = ensure_login_state(browser, username, password, auth_state)
+        ctx = _new_context(browser, state, lean=lean)
+        page = ctx.new_page()
 
-            ext = guess_ext_from_bytes(data)
-            fname = f"{sku} - {filename_sanitize(color_name)} ({color_code}){ext}"
-            (out_dir / fname).write_bytes(data)
-            results.append({"method": "main", "file": fname, "url": src_abs, "color": {"name": color_name, "code": color_code}})
+        res = _scrape_in_page(page, url, out_dir, wait_ms=wait_ms, intercept=intercept, cache=cache,
+                              shards=shards, sink=sink, postprocess=postprocess)
 
         ctx.close()
         browser.close()
 
-    return {"sku": sku, "results": results}
+    _wait_postprocess(res)
+    return res
+
+def _wait_postprocess(res: dict):
+    futs = res.pop("_postprocess", None)
+    if futs:
+        wait(futs)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _js_heap_mb(page) -> float:
+    try:
+        used = page.evaluate("() => (performance.memory && performance.memory.usedJSHeapSize) || 0")
+        return used / (1024 * 1024)
+    except Exception:
+        return 0.0
+
+def slug_dir(out_root: Path, url: str) -> Path:
+    """Cartella di un prodotto prima di conoscerne lo SKU: ultimo pezzo dell'URL in maiuscolo."""
+    return Path(out_root) / (url.rstrip("/").split("/")[-1].upper() or "SKU")
+
+def _record_browser_result(manifest, res: dict, out_dir: Path):
+    if "error" in res:
+        manifest.record_product(res["url"], "error", error=res["error"])
+        return
+    for rec in res["results"]:
+        manifest.record_color(res["url"], res["sku"], rec, out_dir)
+    failed = any(rec.get("method") == "failed" for rec in res["results"])
+    manifest.record_product(res["url"], "partial" if failed else "done", sku=res["sku"])
+
+class BrowserPool:
+    """
+    Un solo processo Chromium, `size` context loggati che lavorano in parallelo.
+
+    Le URL arrivano da una coda (`submit` / `map`); ogni worker ha il suo context e la sua
+    pagina, che viene riciclato dopo `max_pages` prodotti o quando l'heap JS della pagina
+    supera `max_heap_mb`. `handler(page, url, out_dir, **kwargs)` fa lo scraping vero e
+    proprio (default: `_scrape_in_page`; per la variante a target usare `app._scrape_targets_in_page`).
+
+    Le API sync di Playwright non sono thread-safe: il processo Chromium viene lanciato
+    Con `lean` (True o dict di opzioni) i context usano il profilo leggero (`enable_lean_mode`): pagine più veloci e
+    Con `lean` i context usano il profilo leggero (`enable_lean_mode`): pagine più veloci e
+    più piccole, quindi si possono alzare `size` e `max_pages`.
+    """
+
+    def __init__(self, size: int = 3, username: str = None, password: str = None, headless: bool = True,
+                 max_pages: int = 50, max_heap_mb: float = 512, handler=None, auth_state: Path = AUTH_STATE,
+                 lean=False):
+        self.size = size
+        self.username = username
+        self.password = password
+        self.headless = headless
+        self.max_pages = max_pages
+        self.max_heap_mb = max_heap_mb
+        self.handler = handler or _scrape_in_page
+        self.auth_state = Path(auth_state)
+        self.lean = lean
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._alive = 0
+        self._error = None
+        self._pw = None
+        self._browser = None
+        self._endpoint = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        port = _free_port()
+        self._pw = sync_playwright().start()
+        self._browser = self._pw.chromium.launch(headless=self.headless, args=[f"--remote-debugging-port={port}"])
+        self._endpoint = f"http://127.0.0.1:{port}"
+        ensure_login_state(self._browser, self.username, self.password, self.auth_state)
+        self._alive = self.size
+        for i in range(self.size):
+            t = threading.Thread(target=self._worker, name=f"browser-pool-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def close(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+        if self._browser:
+            self._browser.close()
+            self._browser = None
+        if self._pw:
+            self._pw.stop()
+            self._pw = None
+
+    def submit(self, url: str, out_dir: Path, **kwargs) -> Future:
+        fut = Future()
+        with self._lock:
+            if self._threads and self._alive <= 0:
+                # nessun worker vivo: il Future fallisce subito invece di restare in coda per sempre
+                fut.set_exception(RuntimeError(f"BrowserPool senza worker attivi: {self._error!r}"))
+            else:
+                self._queue.put((url, Path(out_dir), kwargs, fut))
+        return fut
+
+    def _worker_died(self, error: Exception):
+        with self._lock:
+            self._alive -= 1
+            self._error = error
+            if self._alive > 0:
+                return  # gli altri worker smaltiscono la coda
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None and item[3].set_running_or_notify_cancel():
+                    item[3].set_exception(RuntimeError(f"BrowserPool senza worker attivi: {error!r}"))
+
+    @property
+    def started(self) -> bool:
+        return bool(self._threads)
+
+    def imap(self, urls, out_root: Path, manifest=None, **kwargs):
+        """
+        Come `map`, ma ogni prodotto va nella cartella del suo slug sotto `out_root` (lo SKU
+        si sa solo dopo) e `urls` viene consumato man mano, con al più 2 * size prodotti in
+        volo: adatto a generatori lunghi o infiniti (CLI, jobqueue). Risultati con "out_dir".
+        """
+        out_root = Path(out_root)
+        if manifest is not None:
+            urls = manifest.pending(urls)
+        pending = {}
+
+        def result(fut):
+            url, out_dir = pending.pop(fut)
+            try:
+                res = {"url": url, "out_dir": str(out_dir), **fut.result()}
+                _wait_postprocess(res)
+            except Exception as e:
+                res = {"url": url, "error": f"{type(e).__name__}: {e}"}
+            if manifest is not None:
+                _record_browser_result(manifest, res, out_dir)
+            return res
+
+        for url in urls:
+            out_dir = slug_dir(out_root, url)
+            skip = {"skip_codes": manifest.done_colors(url)} if manifest is not None else {}
+            pending[self.submit(url, out_dir, **skip, **kwargs)] = (url, out_dir)
+            if len(pending) >= self.size * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    yield result(fut)
+        for fut in as_completed(list(pending)):
+            yield result(fut)
+
+    def map(self, urls, out_dir: Path, manifest=None, **kwargs):
+        """
+        Accoda tutte le URL e restituisce i risultati appena pronti (ordine di completamento).
+        Con `manifest` (manifest.JobManifest) salta prodotti e colori già completati e
+        registra ogni prodotto appena concluso.
+        """
+        if manifest is not None:
+            futures = {self.submit(u, out_dir, skip_codes=manifest.done_colors(u), **kwargs): u
+                       for u in manifest.pending(urls)}
+        else:
+            futures = {self.submit(u, out_dir, **kwargs): u for u in urls}
+        for fut in as_completed(futures):
+            url = futures[fut]
+            try:
+                res = {"url": url, **fut.result()}
+                _wait_postprocess(res)
+            except Exception as e:
+                res = {"url": url, "error": f"{type(e).__name__}: {e}"}
+            if manifest is not None:
+                _record_browser_result(manifest, res, out_dir)
+            yield res
+
+    def _open_context(self, browser):
+        # se lo state salvato è scaduto durante il run, il primo worker che se ne accorge rifà il login
+        state = ensure_login_state(browser, self.username, self.password, self.auth_state)
+        ctx = _new_context(browser, state, lean=self.lean)
+        return ctx, ctx.new_page()
+
+    def _worker(self):
+        fut = None
+        try:
+            with sync_playwright() as p:
+                browser = p.chromium.connect_over_cdp(self._endpoint)
+                ctx = page = None
+                pages_done = 0
+                while True:
+                    item = self._queue.get()
+                    if item is None:
+                        break
+                    url, out_dir, kwargs, fut = item
+                    if not fut.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        if ctx is None:
+                            ctx, page = self._open_context(browser)
+                            pages_done = 0
+                        fut.set_result(self.handler(page, url, out_dir, **kwargs))
+                        pages_done += 1
+                    except Exception as e:
+                        fut.set_exception(e)
+                        pages_done = self.max_pages  # pagina in stato incerto: ricicla il context
+                    if ctx is not None and (pages_done >= self.max_pages or _js_heap_mb(page) > self.max_heap_mb):
+                        try:
+                            ctx.close()
+                        except Exception:
+                            pass
+                        ctx = page = None
+                if ctx is not None:
+                    try:
+                        ctx.close()
+                    except Exception:
+                        pass
+                browser.close()
+        except Exception as e:
+            # es. connect_over_cdp fallito: il prodotto in corso e, se era l'ultimo worker,
+            # quelli in coda falliscono invece di far restare appesi map()/result()
+            if fut is not None and not fut.done():
+                fut.set_exception(e)
+            self._worker_died(e)
@@ -0,0 +1,231 @@
+# cli.py
+# Entry point headless (cron, container): legge le URL prodotto da file (una per riga) o
+# da un job JSONL ({"url": ..., altri campi riportati in uscita sotto "job"}) e scrive su
+# stdout una riga JSON per prodotto appena è pronto. I moduli pesanti (requests, bs4/lxml,
+# Playwright, NumPy/Pillow) si importano solo dopo il parsing degli argomenti e solo se il
+# modo scelto li usa: Playwright solo per `browser` e per il livello browser di `tiered`.
+#
+#   python cli.py urls.txt --out download_out --mode tiered --manifest job.jsonl
+#   cat job.jsonl | python cli.py - --jsonl --mode http --cache
+#   python cli.py seeds.txt --discover --product-re /prodotto/   # seed = sitemap o categorie
+#   python cli.py urls.txt --queue jobs.sqlite                  # accoda e basta
+#   python cli.py --queue jobs.sqlite --work --mode browser     # un worker (lanciarne N)
+
+import argparse, json, sys
+from pathlib import Path
+
+def read_jobs(path: str, jsonl: bool = None):
+    """Genera (url, extra) da un file di URL o da un JSONL; `-` = stdin. Righe vuote e `#` ignorate."""
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if jsonl or (jsonl is None and line.startswith("{")):
+                try:
+                    job = json.loads(line)
+                except ValueError:
+                    print(f"riga JSONL non valida: {line[:80]}", file=sys.stderr)
+                    continue
+                url = job.pop("url", None)
+                if url:
+                    yield url, job
+            else:
+                yield line, {}
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def _summary(res: dict, with_meta: bool) -> dict:
+    out = {k: v for k, v in res.items() if with_meta or k != "meta"}
+    if "results" in out and "saved" not in out:
+        out["saved"] = out.pop("results")  # schema unico anche per il modo browser
+    return out
+
+def _lean_options(value: str) -> dict:
+    try:
+        opts = json.loads(value)
+    except ValueError:
+        opts = None
+    if not isinstance(opts, dict):
+        raise argparse.ArgumentTypeError("atteso un oggetto JSON con le opzioni di enable_lean_mode")
+    return opts
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(prog="cli.py", description="Download immagini prodotto innovativewear.com")
+    ap.add_argument("input", nargs="?", help="file di URL (una per riga) o job JSONL; '-' per stdin")
+    ap.add_argument("--jsonl", action="store_true", default=None, help="forza l'input JSONL (default: auto)")
+    ap.add_argument("--out", type=Path, default=Path("download_out"), help="cartella di output (una sottocartella per SKU)")
+    ap.add_argument("--mode", choices=("http", "browser", "tiered", "parse"), default="http",
+                    help="http: solo requests; browser: Playwright; tiered: HTTP poi browser per i colori mancanti;"
+                         " parse: solo lettura pagina (dry run)")
+    ap.add_argument("--workers", type=int, default=4, help="prodotti in parallelo (HTTP)")
+    ap.add_argument("--browser-workers", type=int, default=2)
+    ap.add_argument("--no-hd", action="store_true", help="salta i tentativi HD")
+    ap.add_argument("--fast-parse", action="store_true", help="estrattore lxml/XPath invece di BeautifulSoup")
+    ap.add_argument("--cache", nargs="?", const=".cache/images", default=None, help="cache immagini su disco")
+    ap.add_argument("--manifest", type=Path, help="manifest JSONL per riprendere il job")
+    ap.add_argument("--refresh", nargs="?", const=".cache/fingerprints.jsonl", default=None,
+                    help="refresh incrementale con le impronte pagina (solo http)")
+    ap.add_argument("--dedup", action="store_true", help="segnala immagini duplicate (NumPy/Pillow)")
+    ap.add_argument("--archive", type=Path, help="scrive le immagini in un .zip/.tar invece che su disco (solo http)")
+    ap.add_argument("--lean", nargs="?", const=True, default=False, type=_lean_options, metavar="JSON",
+                    help="profilo browser leggero (blocca font, media, analytics e script/CSS di terzi);"
+                         " opzioni di enable_lean_mode in JSON, es. '{\"first_party\": null, \"deny\": [\"chat\"]}'")
+    ap.add_argument("--shards", type=int, default=1, help="pagine per prodotto nel browser")
+    ap.add_argument("--username", default=None)
+    ap.add_argument("--password", default=None)
+    ap.add_argument("--with-meta", action="store_true", help="include il meta della pagina nell'output")
+    ap.add_argument("--discover", action="store_true",
+                    help="l'input contiene sitemap/pagine categoria: i prodotti trovati entrano subito nel batch")
+    ap.add_argument("--product-re", default=None, help="regex delle URL prodotto (con --discover)")
+    ap.add_argument("--discover-workers", type=int, default=8, help="pagine di scoperta in parallelo")
+    ap.add_argument("--queue", type=Path, help="coda SQLite condivisa fra worker (jobqueue.py): l'input viene accodato")
+    ap.add_argument("--work", action="store_true", help="con --queue: lavora i prodotti in coda con --mode")
+    ap.add_argument("--poll", type=float, default=None, help="con --work: secondi fra un controllo e l'altro"
+                                                              " a coda vuota (default: esce)")
+    ap.add_argument("--lease", type=float, default=300, help="durata del lease in secondi")
+    ap.add_argument("--max-attempts", type=int, default=3, help="tentativi prima della dead-letter")
+    ap.add_argument("--no-wal", action="store_true", help="coda su storage di rete (NFS/SMB): niente WAL")
+    ap.add_argument("--requeue-dead", action="store_true", help="con --queue: rimette in coda la dead-letter")
+    return ap
+
+def _run(args, urls, session=None):
+    if args.mode == "parse":
+        from scraper import _session, parse_page
+        with _session() as s:
+            for url in urls:
+                try:
+                    meta, _doc = parse_page(s, url, fast=args.fast_parse)
+                    yield {"url": url, "sku": meta["sku"], "meta": meta}
+                except Exception as e:
+                    yield {"url": url, "error": f"{type(e).__name__}: {e}"}
+        return
+
+    cache = manifest = None
+    try:
+        if args.cache:
+            from image_cache import ImageCache
+            cache = ImageCache(Path(args.cache))
+        if args.manifest:
+            from manifest import JobManifest
+            manifest = JobManifest(args.manifest)
+
+        if args.mode == "http":
+            from scraper import scrape_batch
+            opts = {}
+            if args.refresh:
+                from fingerprints import FingerprintStore
+                opts["fingerprints"] = FingerprintStore(Path(args.refresh))
+            if args.dedup:
+                from dedup import PhashIndex
+                opts["dedup"] = PhashIndex()
+            if args.archive:
+                from sinks import open_sink
+                opts["sink"] = open_sink(args.archive)
+            try:
+                yield from scrape_batch(urls, args.out, try_hd=not args.no_hd, max_workers=args.workers,
+                                        session=session, cache=cache, manifest=manifest,
+                                        fast_parse=args.fast_parse, **opts)
+            finally:
+                for v in opts.values():
+                    close = getattr(v, "close", None)
+                    if close:
+                        close()
+        elif args.mode == "tiered":
+            from orchestrator import scrape_tiered
+            yield from scrape_tiered(urls, args.out, username=args.username, password=args.password,
+                                     try_hd=not args.no_hd, http_workers=args.workers,
+                                     browser_workers=args.browser_workers, cache=cache, manifest=manifest,
+                                     fast_parse=args.fast_parse, lean=args.lean, shards=args.shards)
+        else:
+            from browser_scraper import BrowserPool
+            with BrowserPool(size=args.browser_workers, username=args.username, password=args.password,
+                             lean=args.lean) as pool:
+                yield from pool.imap(urls, args.out, manifest=manifest, cache=cache, shards=args.shards)
+    finally:
+        for obj in (cache, manifest):
+            if obj is not None:
+                obj.close()
+
+def _queue_main(args) -> int:
+    from jobqueue import JobQueue, run_worker
+    with JobQueue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts,
+                  wal=not args.no_wal) as q:
+        if args.input:
+            q.enqueue(read_jobs(args.input, args.jsonl))
+        if args.requeue_dead:
+            q.requeue_dead()
+        if not args.work:
+            sys.stdout.write(json.dumps({"queue": str(args.queue), **q.stats()}) + "\n")
+            return 0
+        cache = None
+        if args.cache:
+            from image_cache import ImageCache
+            cache = ImageCache(Path(args.cache))
+        errors = 0
+        try:
+            for res in run_worker(q, args.out, mode=args.mode, workers=args.workers,
+                                  browser_workers=args.browser_workers, poll=args.poll, try_hd=not args.no_hd,
+                                  cache=cache, fast_parse=args.fast_parse, username=args.username,
+                                  password=args.password, lean=args.lean, shards=args.shards):
+                errors += "error" in res
+                sys.stdout.write(json.dumps(_summary(res, args.with_meta), ensure_ascii=False, default=str) + "\n")
+                sys.stdout.flush()
+        finally:
+            if cache is not None:
+                cache.close()
+        return 1 if errors else 0
+
+def main(argv=None) -> int:
+    ap = build_parser()
+    args = ap.parse_args(argv)
+    if args.queue:
+        if args.work and args.mode == "parse":
+            ap.error("--work non supporta --mode parse")
+        return _queue_main(args)
+    if not args.input:
+        ap.error("manca l'input (file di URL, job JSONL o '-')")
+    extras = {}
+
+    found = {}
+    session = None
+
+    def urls():
+        for url, extra in read_jobs(args.input, args.jsonl):
+            if extra:
+                extras[url] = extra
+            yield url
+
+    def discovered():
+        from discovery import discover
+        for prod in discover([u for u, _ in read_jobs(args.input, args.jsonl)], session=session,
+                             max_workers=args.discover_workers, product_re=args.product_re):
+            found[prod["url"]] = prod
+            yield prod["url"]
+
+    if args.discover and args.mode == "http":
+        # una sola sessione (pool, cookie, rate limit) per scoperta e download
+        from scraper import AUTH_STATE, PROBE_WORKERS, _session, load_auth_cookies
+        session = _session(pool_size=args.workers * (PROBE_WORKERS + 1) + args.discover_workers)
+        load_auth_cookies(session, AUTH_STATE)
+
+    errors = 0
+    try:
+        for res in _run(args, discovered() if args.discover else urls(), session=session):
+            out = _summary(res, args.with_meta or args.mode == "parse")
+            if res.get("url") in extras:
+                out["job"] = extras.pop(res["url"])
+            if res.get("url") in found:
+                out["discovered"] = found.pop(res["url"])
+            errors += "error" in res
+            sys.stdout.write(json.dumps(out, ensure_ascii=False, default=str) + "\n")
+            sys.stdout.flush()
+    finally:
+        if session is not None:
+            session.close()
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# colormatch.py
+# Abbinamento nomi colore degli swatch -> colori target (Black, White, LightGrey, ...).
+# La tabella parole chiave / penalità è caricabile da JSON; ColorMatcher la compila in
+# un'unica regex (alternanza, termini più lunghi prima) e calcola i punteggi di un nome
+# contro tutti i target in una sola passata, con cache per nome normalizzato: mappare i
+# colori di un intero catalogo (nomi molto ripetuti) costa pochi millisecondi.
+
+from pathlib import Path
+import json, re
+
+KEYWORDS = {
+    "Black": ["black", "nero"],
+    "White": ["white", "bianco", "off white", "off-white", "ivory", "natural"],
+    "LightGrey": [
+        "sport grey", "sport gray",
+        "light oxford",
+        "grey heather", "gray heather",
+        "heather grey", "heather gray",
+        "ash",
+        "light grey", "light gray",
+        "silver",
+        "grey", "gray",
+    ],
+    "Red": ["red", "rosso", "cardinal", "crimson", "scarlet", "cherry", "burgundy"],
+    "Navy": ["navy", "dark navy", "midnight", "marine", "deep navy"],
+    "Royal": ["royal", "royal blue", "bright blue", "cobalt"],
+}
+
+# penalità “grigi scuri” quando cerchi grigio chiaro: applicata una volta se compare un termine
+PENALTIES = {
+    "LightGrey": {"terms": ["charcoal", "dark", "graphite", "dark heather"], "score": 250},
+}
+
+DEFAULT_TARGETS = ["Black", "White", "LightGrey", "Red", "Navy", "Royal"]
+
+def _norm(s: str) -> str:
+    return re.sub(r"\s+", " ", s.strip().lower())
+
+class ColorMatcher:
+    """
+    Punteggio di un nome per un target = somma di (1000 - 10 * posizione) per ogni parola
+    chiave del target contenuta nel nome, meno la penalità del target se presente.
+    """
+
+    def __init__(self, keywords: dict = None, penalties: dict = None):
+        self.keywords = {t: list(kws) for t, kws in (KEYWORDS if keywords is None else keywords).items()}
+        self.penalties = PENALTIES if penalties is None else penalties
+        self.targets = list(self.keywords) + [t for t in self.penalties if t not in self.keywords]
+        self._col = idx = {t: i for i, t in enumerate(self.targets)}
+        # termine -> [(indice target, peso)]; le penalità sono gruppi (contano una volta sola)
+        self._weights = {}
+        for t, kws in self.keywords.items():
+            for i, kw in enumerate(kws):
+                self._weights.setdefault(_norm(kw), []).append((idx[t], 1000 - i * 10))
+        self._penalty_terms = {}
+        for t, pen in self.penalties.items():
+            for term in pen["terms"]:
+                self._penalty_terms.setdefault(_norm(term), []).append(idx[t])
+        self._penalty_score = [0] * len(self.targets)
+        for t, pen in self.penalties.items():
+            self._penalty_score[idx[t]] = pen["score"]
+        terms = sorted(set(self._weights) | set(self._penalty_terms), key=len, reverse=True)
+        # lookahead: in ogni posizione trova il termine più lungo (match sovrapposti inclusi);
+        # i termini più corti che partono nello stesso punto ne sono prefissi
+        self._re = re.compile("(?=(" + "|".join(map(re.escape, terms)) + "))") if terms else None
+        self._prefixes = {t: [p for p in terms if t.startswith(p)] for t in terms}
+        self._cache = {}
+
+    @classmethod
+    def from_file(cls, path: Path) -> "ColorMatcher":
+        """JSON: {"keywords": {target: [termini...]}, "penalties": {target: {"terms": [...], "score": n}}}."""
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(data.get("keywords"), data.get("penalties", {}))
+
+    def scores(self, name: str) -> list[int]:
+        """Punteggi di `name` per tutti i target (nell'ordine di `self.targets`)."""
+        cached = self._cache.get(name)
+        if cached is not None:
+            return cached
+        n = _norm(name)
+        cached = self._cache.get(n)
+        if cached is not None:
+            self._cache[name] = cached
+            return cached
+        found = set()
+        if self._re is not None:
+            for m in self._re.finditer(n):
+                found.update(self._prefixes[m.group(1)])
+        out = [0] * len(self.targets)
+        penalized = set()
+        for term in found:
+            for ti, w in self._weights.get(term, ()):
+                out[ti] += w
+            penalized.update(self._penalty_terms.get(term, ()))
+        for ti in penalized:
+            out[ti] -= self._penalty_score[ti]
+        self._cache[n] = self._cache[name] = out
+        return out
+
+    def score(self, target: str, name: str) -> int:
+        c = self._col.get(target)
+        return 0 if c is None else self.scores(name)[c]
+
+    def best_for(self, target: str, names: list[str]) -> str | None:
+        """Il nome col punteggio più alto per `target` (a parità vince il primo), None se nessuno > 0."""
+        best, best_score = None, 0
+        for name in names:
+            s = self.score(target, name)
+            if s > best_score:
+                best, best_score = name, s
+        return best
+
+    def assign(self, targets: list[str], names: list[str], unique: bool = True) -> dict:
+        """
+        {target: nome | None}. Con `unique` ogni nome va al più a un target: si assegnano
+        prima le coppie col punteggio più alto; a parità prima il nome conteso da meno target
+        (es. "Royal Navy" va a Royal se esiste anche "Navy"), poi ordine dei target e degli swatch.
+        """
+        if not unique:
+            return {t: self.best_for(t, names) for t in targets}
+        cols = [(ti, self._col.get(t)) for ti, t in enumerate(targets)]
+        pairs = []
+        for ni, name in enumerate(names):
+            sc = self.scores(name)
+            hits = [(ti, sc[c]) for ti, c in cols if c is not None and sc[c] > 0]
+            pairs.extend((-s, len(hits), ti, ni) for ti, s in hits)
+        pairs.sort()
+        out = dict.fromkeys(targets)
+        used = set()
+        for _, _, ti, ni in pairs:
+            if out[targets[ti]] is None and ni not in used:
+                out[targets[ti]] = names[ni]
+                used.add(ni)
+        return out
+
+    def assign_many(self, swatch_lists, targets: list[str] = None, unique: bool = True):
+        """`assign` su molti prodotti (iterabile di liste di nomi); generatore di dict."""
+        targets = targets or DEFAULT_TARGETS
+        for names in swatch_lists:
+            yield self.assign(targets, names, unique=unique)
+
+DEFAULT_MATCHER = ColorMatcher()
@@ -0,0 +1,175 @@
+# dedup.py
+# Rilevamento duplicati dopo il download: digest dei byte + dHash percettivo (64 bit)
+# calcolato con NumPy su una decodifica ridotta (Pillow `draft`: per i JPEG la riduzione
+# avviene già in decodifica). Nello stesso prodotto i duplicati vengono segnalati (e, se
+# identici byte a byte, opzionalmente collassati in hardlink); un colore con lo stesso file
+# di un altro colore è marcato `suspect`. Il dHash guarda solo i gradienti di luminosità (lo
+# stesso capo in due colori, o due tinte unite, ha quasi lo stesso hash): le corrispondenze
+# percettive sono solo informative. Un indice globale SQLite permette di trovare le stesse
+# foto riusate su SKU diversi.
+
+from pathlib import Path
+import os, sqlite3, threading
+
+import numpy as np
+from PIL import Image
+
+from manifest import _file_sha256
+
+DHASH_SIZE = 8
+DHASH_THRESHOLD = 4  # bit diversi su 64 entro cui due immagini sono "la stessa foto"
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _load_gray(path: Path, size: tuple[int, int]) -> np.ndarray:
+    with Image.open(path) as im:
+        im.draft("L", (size[0] * 4, size[1] * 4))
+        return np.asarray(im.convert("L").resize(size, Image.BILINEAR), dtype=np.int16)
+
+def dhash_files(paths: list[Path], hash_size: int = DHASH_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """
+    dHash di più immagini in un colpo solo: ritorna (hash uint64, maschera immagini leggibili).
+    Solo la decodifica è per-file; confronto e impacchettamento dei bit sono vettoriali.
+    """
+    n = len(paths)
+    gray = np.zeros((n, hash_size, hash_size + 1), dtype=np.int16)
+    ok = np.zeros(n, dtype=bool)
+    for i, p in enumerate(paths):
+        try:
+            gray[i] = _load_gray(p, (hash_size + 1, hash_size))
+            ok[i] = True
+        except Exception:
+            pass
+    bits = (gray[:, :, 1:] > gray[:, :, :-1]).reshape(n, -1)
+    packed = np.packbits(bits, axis=1)  # (n, hash_size**2 / 8)
+    hashes = packed.view(">u8").reshape(n).astype(np.uint64)
+    return hashes, ok
+
+def hamming_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distanze di Hamming fra tutte le coppie di hash a 64 bit (matrice len(a) x len(b))."""
+    x = np.ascontiguousarray(a[:, None] ^ b[None, :])
+    return _POPCOUNT[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.uint16)
+
+def _to_signed(h: int) -> int:
+    # SQLite memorizza interi a 64 bit con segno
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+class PhashIndex:
+    """Indice globale (SQLite) di digest + dHash delle immagini salvate, per i duplicati fra SKU."""
+
+    def __init__(self, path: Path = Path(".cache/phash.sqlite")):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS images (sha256 TEXT, dhash INTEGER, sku TEXT, file TEXT,"
+            " PRIMARY KEY (sku, file))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_sha ON images (sha256)")
+        self._db.commit()
+        rows = self._db.execute("SELECT dhash, sku, file FROM images WHERE dhash IS NOT NULL").fetchall()
+        self._rows = [(sku, file) for _, sku, file in rows]
+        # buffer che cresce per raddoppio: `add` costa O(1) ammortizzato, non una copia per immagine
+        self._hashes = np.zeros(max(len(rows), 1024), dtype=np.uint64)
+        self._hashes[:len(rows)] = [d & 0xFFFFFFFFFFFFFFFF for d, _, _ in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, sha256: str, dhash: int | None, threshold: int = DHASH_THRESHOLD) -> list[dict]:
+        """Immagini già indicizzate identiche (stesso digest) o quasi (dHash entro `threshold`)."""
+        with self._lock:
+            out = [{"sku": sku, "file": file, "kind": "exact"} for sku, file in self._db.execute(
+                "SELECT sku, file FROM images WHERE sha256 = ?", (sha256,))]
+            if dhash is not None and self._rows:
+                dist = hamming_matrix(np.array([dhash], dtype=np.uint64), self._hashes[:len(self._rows)])[0]
+                seen = {(o["sku"], o["file"]) for o in out}
+                for i in np.flatnonzero(dist <= threshold):
+                    if self._rows[i] not in seen:
+                        out.append({"sku": self._rows[i][0], "file": self._rows[i][1], "kind": "perceptual"})
+        return out
+
+    def add(self, sha256: str, dhash: int | None, sku: str, file: str):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO images (sha256, dhash, sku, file) VALUES (?, ?, ?, ?)",
+                             (sha256, None if dhash is None else _to_signed(dhash), sku, file))
+            self._db.commit()
+            if dhash is not None:
+                n = len(self._rows)
+                if n == len(self._hashes):
+                    self._hashes = np.concatenate([self._hashes, np.zeros(n, dtype=np.uint64)])
+                self._hashes[n] = np.uint64(dhash)
+                self._rows.append((sku, file))
+
+def annotate_duplicates(saved: list[dict], out_dir: Path, sku: str = None, index: PhashIndex = None,
+                        threshold: int = DHASH_THRESHOLD, collapse: bool = False) -> list[dict]:
+    """
+    Aggiunge ai record salvati (risultati di download_all_colors / scrape_with_browser)
+    `digest`, `dhash` e, per i duplicati nello stesso prodotto, `duplicate_of` /
+    `duplicate_kind`: "exact" (stessi byte di un record precedente qualunque) oppure
+    "perceptual" (dHash vicino, stesso colore). `suspect=True` su entrambi i record se i
+    byte identici sono di colori diversi (es. immagine di ripiego). Un match percettivo
+    con un altro colore è normale (stessa foto ricolorata) e finisce solo in `similar_to`. Con `collapse=True` i duplicati esatti diventano hardlink
+    del primo file. Con `index` aggiunge `same_as` (stesse foto su altri SKU) e indicizza.
+    """
+    out_dir = Path(out_dir)
+    recs = [r for r in saved if r.get("file")]
+    if not recs:
+        return saved
+    paths = [out_dir / Path(r["file"]).name for r in recs]
+    hashes, ok = dhash_files(paths)
+    dist = hamming_matrix(hashes, hashes)
+    for r, p, h, good in zip(recs, paths, hashes, ok):
+        if not r.get("digest"):
+            r["digest"] = _file_sha256(p)
+        r["dhash"] = f"{int(h):016x}" if good else None
+
+    first_by_digest = {}  # digest -> indice del primo record con quei byte
+    originals = []  # indici dei non-duplicati, nell'ordine dei record
+    for i, r in enumerate(recs):
+        j = first_by_digest.get(r["digest"]) if r["digest"] is not None else None
+        if j is not None:
+            # stessi byte: prima del confronto percettivo, contro tutti i record precedenti
+            r["duplicate_of"] = recs[j]["file"]
+            r["duplicate_kind"] = "exact"
+            if (r.get("color") or {}) != (recs[j].get("color") or {}):
+                r["suspect"] = True
+                recs[j]["suspect"] = True
+            if collapse and not os.path.samefile(paths[i], paths[j]):
+                tmp = paths[i].with_name(paths[i].name + ".link")
+                try:
+                    os.link(paths[j], tmp)
+                    os.replace(tmp, paths[i])
+                except OSError:
+                    pass  # filesystem senza hardlink: resta la copia
+            continue
+        if r["digest"] is not None:
+            first_by_digest[r["digest"]] = i
+        similar = [j for j in originals if ok[i] and ok[j] and dist[i, j] <= threshold]
+        same_color = [j for j in similar if (r.get("color") or {}) == (recs[j].get("color") or {})]
+        if same_color:
+            r["duplicate_of"] = recs[same_color[0]]["file"]
+            r["duplicate_kind"] = "perceptual"
+            continue
+        if similar:
+            # altro colore, stessa foto ricolorata: solo informativo
+            r["similar_to"] = [recs[j]["file"] for j in similar]
+        originals.append(i)
+
+    if index is not None:
+        for i in originals:
+            r = recs[i]
+            dh = int(hashes[i]) if ok[i] else None
+            same = [m for m in index.lookup(r["digest"], dh, threshold) if m["sku"] != sku]
+            if same:
+                r["same_as"] = same
+            index.add(r["digest"], dh, sku, r["file"])
+    return saved
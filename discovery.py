@@ -0,0 +1,137 @@
+# discovery.py
+# Scoperta delle URL prodotto a partire da sitemap XML (anche indici e .gz) e pagine
+# categoria/listing con paginazione, scaricate in parallelo con un pool limitato. Le URL
+# prodotto (deduplicate) escono in streaming appena trovate, così possono entrare subito
+# in scrape_batch mentre la scoperta continua:
+#
+#   session = _session(pool_size=32)
+#   found = discover(["https://www.innovativewear.com/sitemap.xml"], session=session)
+#   for res in scrape_batch((p["url"] for p in found), out_root, session=session): ...
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import gzip, re, urllib.parse
+import xml.etree.ElementTree as ET
+
+import requests
+
+from scraper import AUTH_STATE, _session, filename_sanitize, load_auth_cookies
+
+# selettori delle pagine listing (aggiorna qui se il sito cambia)
+SEL_PRODUCT_LINKS = ".productItem a[href], .product-item a[href], .wrapperProdotto a[href], a.js_productLink[href]"
+SEL_PRODUCT_CODE = ".prodCode, .productCode"
+SEL_PAGINATION = "a[rel='next'], .pagination a[href], ul.pagination a[href], a[href*='page=']"
+
+DISCOVERY_WORKERS = 8
+
+def canonical_url(url: str) -> str:
+    """URL senza query/fragment e senza slash finale: chiave di deduplica dei prodotti."""
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip("/") or "/", "", ""))
+
+def sku_from_url(url: str) -> str:
+    # stesso ripiego di parse_page: ultima parte del path in maiuscolo
+    return filename_sanitize(urllib.parse.urlsplit(url).path.rstrip("/").split("/")[-1].upper())
+
+def parse_sitemap(data: bytes) -> tuple[list[str], list[str]]:
+    """(sitemap figlie, URL) da un urlset o da un sitemapindex."""
+    root = ET.fromstring(data)
+    locs = [(el.text or "").strip() for el in root.iter() if el.tag.endswith("loc")]
+    locs = [l for l in locs if l]
+    if root.tag.endswith("sitemapindex"):
+        return locs, []
+    return [], locs
+
+def parse_listing(html: str, base_url: str, product_sel: str = SEL_PRODUCT_LINKS,
+                  pagination_sel: str = SEL_PAGINATION) -> tuple[list[tuple[str, str | None]], list[str]]:
+    """([(url prodotto, sku | None)], pagine successive) da una pagina categoria."""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "lxml")
+    products = []
+    for a in soup.select(product_sel):
+        url = urllib.parse.urljoin(base_url, a["href"])
+        card = a.find_parent(class_=re.compile(r"product|prodott", re.I))
+        code = card.select_one(SEL_PRODUCT_CODE) if card else None
+        products.append((url, code.get_text(strip=True) if code else None))
+    pages = [urllib.parse.urljoin(base_url, a["href"]) for a in soup.select(pagination_sel) if a.get("href")]
+    return products, pages
+
+def _is_sitemap(url: str, resp: requests.Response, data: bytes) -> bool:
+    ctype = resp.headers.get("Content-Type", "").lower()
+    head = data[:512].lstrip()
+    return "xml" in ctype or url.lower().split("?")[0].endswith((".xml", ".xml.gz")) or head.startswith(b"<?xml")
+
+def _fetch(session: requests.Session, url: str, product_sel: str, pagination_sel: str):
+    """Scarica e analizza una pagina: ("sitemap" | "listing", prodotti, pagine da seguire)."""
+    resp = session.get(url, timeout=30, allow_redirects=True)
+    resp.raise_for_status()
+    data = resp.content
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    if _is_sitemap(url, resp, data):
+        children, locs = parse_sitemap(data)
+        return "sitemap", [(u, None) for u in locs], children
+    products, pages = parse_listing(resp.text, resp.url, product_sel, pagination_sel)
+    return "listing", products, pages
+
+def discover(seeds, session: requests.Session | None = None, max_workers: int = DISCOVERY_WORKERS,
+             max_pages: int = 1000, product_re: str | None = None, same_host: bool = True,
+             product_sel: str = SEL_PRODUCT_LINKS, pagination_sel: str = SEL_PAGINATION,
+             auth_state: Path | None = AUTH_STATE):
+    """
+    Generatore di {"url", "sku", "source"} per ogni prodotto nuovo. `seeds`: sitemap o
+    pagine categoria. Al massimo `max_workers` pagine in volo e `max_pages` pagine in
+    totale; con `product_re` si tengono solo le URL prodotto che la soddisfano (utile con
+    sitemap che elencano anche categorie). Le pagine che falliscono vengono saltate.
+    Passando la stessa `session` di scrape_batch si condividono pool di connessioni,
+    cookie e controllo di velocità.
+    """
+    seeds = list(seeds)
+    own_session = session is None
+    if own_session:
+        session = _session(pool_size=max_workers)
+        if auth_state:
+            load_auth_cookies(session, auth_state)
+    product_re = re.compile(product_re) if product_re else None
+    hosts = {urllib.parse.urlsplit(s).netloc.lower() for s in seeds}
+    seen_pages, seen_urls, seen_skus = set(), set(), set()
+
+    def allowed(url: str) -> bool:
+        return not same_host or urllib.parse.urlsplit(url).netloc.lower() in hosts
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            pending = {}
+
+            def enqueue(url: str):
+                key = urllib.parse.urldefrag(url)[0]
+                if key not in seen_pages and len(seen_pages) < max_pages and allowed(url):
+                    seen_pages.add(key)
+                    pending[ex.submit(_fetch, session, url, product_sel, pagination_sel)] = url
+
+            for seed in seeds:
+                enqueue(seed)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    page_url = pending.pop(fut)
+                    try:
+                        kind, products, follow = fut.result()
+                    except Exception:
+                        continue
+                    for link in follow:
+                        enqueue(link)
+                    for url, sku in products:
+                        key = canonical_url(url)
+                        if key in seen_urls or not allowed(url) or (product_re and not product_re.search(url)):
+                            continue
+                        sku = filename_sanitize(sku) if sku else None
+                        if sku and sku in seen_skus:
+                            continue
+                        seen_urls.add(key)
+                        if sku:
+                            seen_skus.add(sku)
+                        yield {"url": url, "sku": sku or sku_from_url(url), "source": page_url}
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,69 @@
+# fingerprints.py
+# Impronte per-URL delle pagine prodotto (vedi scraper.page_fingerprint) per il refresh
+# incrementale del catalogo: JSONL append-only (vince l'ultima riga per URL), con
+# ETag/Last-Modified della pagina per il GET condizionale del run successivo.
+
+from pathlib import Path
+import json, os, threading, time
+
+FINGERPRINTS_PATH = Path(".cache/fingerprints.jsonl")
+
+class FingerprintStore:
+    def __init__(self, path: Path = FINGERPRINTS_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._data = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._data[rec["url"]] = rec
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "a", encoding="utf-8")
+        if self._f.tell():
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._f.write("\n")
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, url: str) -> dict:
+        with self._lock:
+            return dict(self._data.get(url) or {})
+
+    def update(self, url: str, meta: dict, color_fps: dict, etag: str = None, last_modified: str = None,
+               complete: bool = True):
+        """
+        Memorizza l'impronta di `url`. `complete=False` (qualche colore fallito) fa sì che il
+        prossimo run non usi le scorciatoie 304 / impronta uguale e ritenti i colori mancanti.
+        """
+        rec = {"url": url, "sku": meta.get("sku"), "fingerprint": meta.get("fingerprint"),
+               "colors": color_fps, "etag": etag, "last_modified": last_modified,
+               "complete": complete, "ts": time.time()}
+        with self._lock:
+            self._data[url] = rec
+            self._f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._f.flush()
+
+    def compact(self):
+        """Riscrive il file con una sola riga per URL."""
+        with self._lock:
+            self._f.close()
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                for rec in self._data.values():
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            self._f = open(self.path, "a", encoding="utf-8")
@@ -0,0 +1,126 @@
+# image_cache.py
+# Cache immagini su disco indirizzata per contenuto, con rivalidazione condizionale.
+# - blob in <root>/objects/ab/<sha256><ext>: byte identici (anche da URL/colori diversi) salvati una volta sola
+# - indice SQLite url -> sha256, ETag, Last-Modified, size: i run successivi inviano
+#   If-None-Match / If-Modified-Since e su 304 riusano il blob
+# - i file nelle cartelle SKU sono hardlink ai blob (copia se il filesystem non li supporta)
+
+from pathlib import Path
+import hashlib, os, shutil, sqlite3, tempfile, threading, time
+
+import requests
+
+from scraper import guess_ext_from_bytes, stream_to_file
+
+CACHE_DIR = Path(".cache/images")
+
+class ImageCache:
+    def __init__(self, root: Path = CACHE_DIR):
+        self.root = Path(root)
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.root / "index.sqlite"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            " url TEXT PRIMARY KEY, sha256 TEXT NOT NULL, ext TEXT NOT NULL, size INTEGER NOT NULL,"
+            " etag TEXT, last_modified TEXT, checked REAL)"
+        )
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def blob_path(self, sha256: str, ext: str) -> Path:
+        return self.root / "objects" / sha256[:2] / f"{sha256}{ext}"
+
+    def lookup(self, url: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, ext, size, etag, last_modified FROM urls WHERE url = ?", (url,)
+            ).fetchone()
+        if not row:
+            return None
+        sha, ext, size, etag, lm = row
+        return {"url": url, "sha256": sha, "ext": ext, "size": size, "etag": etag, "last_modified": lm,
+                "path": self.blob_path(sha, ext)}
+
+    def put(self, url: str, data: bytes, etag: str = None, last_modified: str = None) -> dict:
+        """Salva `data` (una volta sola per contenuto) e aggiorna l'indice per `url`."""
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        # nome unico anche fra processi (più worker di jobqueue sulla stessa cache)
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir, prefix=".put-", suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return self.put_file(url, {"tmp": tmp, "ext": guess_ext_from_bytes(data), "size": len(data),
+                                   "sha256": hashlib.sha256(data).hexdigest(),
+                                   "etag": etag, "last_modified": last_modified})
+
+    def put_file(self, url: str, info: dict) -> dict:
+        """Sposta nella cache un download in streaming (vedi `scraper.stream_to_file`)."""
+        path = self.blob_path(info["sha256"], info["ext"])
+        if path.exists():
+            os.unlink(info["tmp"])
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(info["tmp"], path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls (url, sha256, ext, size, etag, last_modified, checked)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, info["sha256"], info["ext"], info["size"], info["etag"], info["last_modified"], time.time()),
+            )
+            self._db.commit()
+        return {"url": url, "sha256": info["sha256"], "ext": info["ext"], "size": info["size"],
+                "etag": info["etag"], "last_modified": info["last_modified"], "path": path, "cached": False}
+
+    def fetch(self, session: requests.Session, url: str) -> dict | None:
+        """
+        GET condizionale di `url`. Ritorna le info del blob (`cached=True` se il server ha
+        risposto 304), oppure None se la risorsa non è un'immagine scaricabile.
+        """
+        entry = self.lookup(url)
+        headers = {}
+        if entry and entry["path"].exists():
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with session.get(url, headers=headers, timeout=45, allow_redirects=True, stream=True) as r:
+                if r.status_code == 304 and headers:
+                    with self._lock:
+                        self._db.execute("UPDATE urls SET checked = ? WHERE url = ?", (time.time(), url))
+                        self._db.commit()
+                    return {**entry, "cached": True}
+                ctype = r.headers.get("Content-Type", "").lower()
+                if r.status_code != 200 or "text/html" in ctype:
+                    return None
+                info = stream_to_file(r, self.root / "tmp")
+        except Exception:
+            return None
+        if not info["size"]:
+            os.unlink(info["tmp"])
+            return None
+        return self.put_file(url, info)
+
+    def link_into(self, info: dict, dest: Path) -> Path:
+        """Mette il blob in `dest` come hardlink (copia come ripiego)."""
+        dest = Path(dest)
+        src = info["path"]
+        try:
+            if dest.exists():
+                if os.path.samefile(src, dest):
+                    return dest
+                dest.unlink()
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+        return dest
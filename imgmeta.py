@@ -0,0 +1,86 @@
+# imgmeta.py
+# Dimensioni reali delle immagini lette dai soli byte di header (JPEG SOFn, PNG IHDR,
+# WebP VP8/VP8L/VP8X, GIF), senza decodificare: bastano i primi KB di una risposta
+# parziale. `rank_key` è l'unico criterio di ranking dei candidati usato da scraper.py,
+# browser_scraper.py e app.py.
+
+import re
+
+HEADER_BYTES = 16384  # di norma sufficienti; per JPEG con EXIF/ICC più grandi vedi `jpeg_scan`
+JPEG_SEGMENT_BYTES = 4096  # finestra letta a ogni salto di segmento JPEG
+JPEG_MAX_JUMPS = 4
+# stima prudente dei pixel per byte di un JPEG, solo quando le dimensioni restano ignote
+JPEG_PIXELS_PER_BYTE = 4
+
+_SIZE_IN_URL_RE = re.compile(r"(\d{2,5})x(\d{2,5})")
+
+def jpeg_scan(data: bytes, offset: int = 2, base: int = 0) -> tuple[tuple[int, int] | None, int]:
+    """
+    Percorre i segmenti JPEG di `data` (byte del file a partire dall'offset `base`) dal
+    segmento all'offset assoluto `offset`. Ritorna (dimensioni, None) se trova il SOF,
+    altrimenti (None, offset assoluto da cui continuare a leggere, es. dopo un APP1 enorme).
+    """
+    i = offset - base
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:  # byte di riempimento
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # marker senza lunghezza
+            i += 2
+            continue
+        seg_len = int.from_bytes(data[i + 2:i + 4], "big")
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            h = int.from_bytes(data[i + 5:i + 7], "big")
+            w = int.from_bytes(data[i + 7:i + 9], "big")
+            return (w, h), None
+        i += 2 + seg_len
+    return None, base + i
+
+def _jpeg_size(data: bytes):
+    return jpeg_scan(data)[0]
+
+def _webp_size(data: bytes):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30 and data[23:26] == b"\x9d\x01\x2a":
+        w = int.from_bytes(data[26:28], "little") & 0x3FFF
+        h = int.from_bytes(data[28:30], "little") & 0x3FFF
+        return w, h
+    if chunk == b"VP8L" and len(data) >= 25 and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+def image_size(data: bytes) -> tuple[int, int] | None:
+    """(larghezza, altezza) dai primi byte di un'immagine, None se formato/header non riconosciuto."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24 and data[12:16] == b"IHDR":
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:2] == b"\xff\xd8":
+        return _jpeg_size(data)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return _webp_size(data)
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return int.from_bytes(data[6:8], "little"), int.from_bytes(data[8:10], "little")
+    return None
+
+def url_size_hint(url: str) -> tuple[int, int]:
+    """Dimensione dichiarata nell'URL (es. opt-1600x1600-...), (0, 0) se assente."""
+    m = _SIZE_IN_URL_RE.search(url or "")
+    return (int(m.group(1)), int(m.group(2))) if m else (0, 0)
+
+def rank_key(info: dict):
+    """
+    Chiave di ordinamento (più grande = meglio) per un candidato sondato:
+    {"url", "dims": (w, h) | None, "length": byte totali | None}.
+    Area reale letta dall'header; se ignota (header non letto) quella dichiarata nell'URL
+    e in mancanza una stima dai byte: un candidato con dimensioni ignote non finisce dietro
+    a uno piccolo solo perché di quest'ultimo si conoscono le dimensioni.
+    """
+    length = info.get("length") or 0
+    w, h = info.get("dims") or url_size_hint(info.get("url") or "")
+    return (w * h or length * JPEG_PIXELS_PER_BYTE, length)
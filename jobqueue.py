@@ -0,0 +1,226 @@
+# jobqueue.py
+# Coda di lavoro SQLite condivisa fra più processi worker (anche su più macchine con lo
+# stesso storage): ogni prodotto viene preso in lease da un solo worker, che lo rinnova con
+# un heartbeat finché ci lavora. Se il worker muore il lease scade e il prodotto torna
+# disponibile; dopo `max_attempts` tentativi falliti finisce nella dead-letter ("dead").
+#
+#   q = JobQueue(".cache/jobs.sqlite")
+#   q.enqueue(urls)
+#   for res in run_worker(q, Path("download_out"), mode="browser"):   # in N processi
+#       ...
+#
+# Stati: queued -> leased -> done | queued (retry con backoff) | dead.
+# Su storage di rete usare `wal=False`: il WAL di SQLite richiede memoria condivisa locale.
+
+from pathlib import Path
+import itertools, json, os, socket, sqlite3, threading, time, uuid
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 30  # secondi, raddoppiati a ogni tentativo fallito
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+class JobQueue:
+    def __init__(self, path: Path = Path(".cache/jobs.sqlite"), lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, wal: bool = True):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # autocommit: le transazioni si aprono a mano con BEGIN IMMEDIATE
+        self._db = sqlite3.connect(str(self.path), timeout=60, isolation_level=None, check_same_thread=False)
+        if wal:
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (url TEXT PRIMARY KEY, payload TEXT,"
+            " status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,"
+            " owner TEXT, lease_until REAL, not_before REAL NOT NULL DEFAULT 0,"
+            " error TEXT, result TEXT, updated REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before)")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _tx(self, fn):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(self._db)
+                self._db.execute("COMMIT")
+                return out
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, jobs) -> int:
+        """Accoda URL o (url, payload dict); le URL già presenti (in qualunque stato) restano come sono."""
+        now = time.time()
+        rows = []
+        for job in jobs:
+            url, payload = (job, None) if isinstance(job, str) else job
+            rows.append((url, json.dumps(payload) if payload else None, now))
+        return self._tx(lambda db: db.executemany(
+            "INSERT OR IGNORE INTO jobs (url, payload, updated) VALUES (?, ?, ?)", rows).rowcount)
+
+    def lease(self, owner: str, n: int = 1) -> list[dict]:
+        """
+        Prende fino a `n` prodotti: quelli in coda (passato il backoff) e quelli con lease
+        scaduto. Un lease scaduto all'ultimo tentativo va in dead-letter.
+        """
+        def fn(db):
+            now = time.time()
+            db.execute("UPDATE jobs SET status = 'dead', owner = NULL, updated = ?,"
+                       " error = COALESCE(error || ' / ', '') || 'lease scaduto' "
+                       "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                       (now, now, self.max_attempts))
+            rows = db.execute("SELECT url, payload, attempts FROM jobs WHERE (status = 'queued' AND not_before <= ?)"
+                              " OR (status = 'leased' AND lease_until < ?) ORDER BY not_before, rowid LIMIT ?",
+                              (now, now, n)).fetchall()
+            db.executemany("UPDATE jobs SET status = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1,"
+                           " updated = ? WHERE url = ?",
+                           [(owner, now + self.lease_seconds, now, url) for url, _, _ in rows])
+            return [{"url": url, "payload": json.loads(payload) if payload else {}, "attempt": attempts + 1}
+                    for url, payload, attempts in rows]
+        return self._tx(fn)
+
+    def heartbeat(self, owner: str) -> int:
+        """Rinnova tutti i lease di `owner`; ritorna quanti sono ancora suoi."""
+        now = time.time()
+        return self._tx(lambda db: db.execute(
+            "UPDATE jobs SET lease_until = ?, updated = ? WHERE owner = ? AND status = 'leased'",
+            (now + self.lease_seconds, now, owner)).rowcount)
+
+    def complete(self, owner: str, url: str, result: dict = None) -> bool:
+        """False se il lease non è più di `owner` (scaduto e preso da un altro worker)."""
+        return self._tx(lambda db: db.execute(
+            "UPDATE jobs SET status = 'done', owner = NULL, lease_until = NULL, error = NULL, result = ?,"
+            " updated = ? WHERE url = ? AND owner = ? AND status = 'leased'",
+            (json.dumps(result, default=str) if result is not None else None, time.time(), url, owner)).rowcount == 1)
+
+    def fail(self, owner: str, url: str, error: str) -> bool:
+        """Rimette in coda con backoff esponenziale, o in dead-letter dopo `max_attempts`."""
+        now = time.time()
+        return self._tx(lambda db: db.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'queued' END,"
+            " not_before = ? + ? * (1 << (attempts - 1)), owner = NULL, lease_until = NULL, error = ?,"
+            " updated = ? WHERE url = ? AND owner = ? AND status = 'leased'",
+            (self.max_attempts, now, RETRY_BACKOFF, error, now, url, owner)).rowcount == 1)
+
+    def release(self, owner: str) -> int:
+        """Restituisce i lease di `owner` senza contare il tentativo (uscita pulita del worker)."""
+        return self._tx(lambda db: db.execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0),"
+            " updated = ? WHERE owner = ? AND status = 'leased'", (time.time(), owner)).rowcount)
+
+    def requeue_dead(self) -> int:
+        return self._tx(lambda db: db.execute(
+            "UPDATE jobs SET status = 'queued', attempts = 0, not_before = 0, updated = ? WHERE status = 'dead'",
+            (time.time(),)).rowcount)
+
+    def dead(self) -> list[dict]:
+        with self._lock:
+            return [{"url": url, "attempts": attempts, "error": error} for url, attempts, error in self._db.execute(
+                "SELECT url, attempts, error FROM jobs WHERE status = 'dead' ORDER BY updated")]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+def run_worker(queue: JobQueue, out_root: Path, mode: str = "http", owner: str = None, workers: int = 4,
+               browser_workers: int = 2, poll: float | None = None, try_hd: bool = True, cache=None,
+               fast_parse: bool = False, username: str = None, password: str = None, lean: bool | dict = False,
+               shards: int = 1):
+    """
+    Worker: prende prodotti in lease, li elabora con `mode` ("http": scrape_batch /
+    download_all_colors; "browser": scrape_with_browser nel BrowserPool; "tiered":
+    scrape_tiered) e riporta l'esito alla coda. Generatore dei risultati (con "job" =
+    payload e "attempt"). Con `poll=None` esce quando la coda è vuota, altrimenti
+    riprova ogni `poll` secondi. Un thread rinnova i lease ogni lease_seconds / 3.
+    Nei modi browser/tiered un solo BrowserPool (Chromium + login) resta aperto per tutta
+    la vita del worker, non uno per giro di poll.
+    """
+    out_root = Path(out_root)
+    owner = owner or worker_name()
+    jobs = {}  # url -> job in lease, finché l'esito non è registrato
+    stop = threading.Event()
+    pool = None
+    if mode in ("browser", "tiered"):
+        from browser_scraper import BrowserPool  # avviato al primo prodotto che lo usa
+        pool = BrowserPool(size=browser_workers, username=username, password=password, lean=lean)
+
+    def beat():
+        while not stop.wait(queue.lease_seconds / 3):
+            try:
+                queue.heartbeat(owner)
+            except sqlite3.Error:
+                pass  # db occupato: si riprova al giro dopo, il lease ha margine
+
+    def leased():
+        # una URL alla volta: il batch ne chiede di nuove solo quando ha posto
+        while True:
+            got = queue.lease(owner)
+            if not got:
+                return
+            jobs[got[0]["url"]] = got[0]
+            yield got[0]["url"]
+
+    def results(urls):
+        if mode == "http":
+            from scraper import scrape_batch
+            return scrape_batch(urls, out_root, try_hd=try_hd, max_workers=workers, cache=cache,
+                                fast_parse=fast_parse)
+        if mode == "tiered":
+            from orchestrator import scrape_tiered
+            return scrape_tiered(urls, out_root, username=username, password=password, try_hd=try_hd,
+                                 http_workers=workers, browser_workers=browser_workers, cache=cache,
+                                 fast_parse=fast_parse, lean=lean, shards=shards, pool=pool)
+        if mode == "browser":
+            return browser_results(urls)
+        raise ValueError(f"modo sconosciuto: {mode}")
+
+    def browser_results(urls):
+        urls = iter(urls)
+        first = next(urls, None)
+        if first is None:
+            return
+        if not pool.started:
+            pool.start()
+        yield from pool.imap(itertools.chain([first], urls), out_root, cache=cache, shards=shards)
+
+    heart = threading.Thread(target=beat, name="jobqueue-heartbeat", daemon=True)
+    heart.start()
+    try:
+        while True:
+            for res in results(leased()):
+                job = jobs.pop(res["url"], None)
+                if job is None:
+                    continue
+                if "error" in res:
+                    queue.fail(owner, res["url"], res["error"])
+                else:
+                    queue.complete(owner, res["url"], {k: v for k, v in res.items() if k != "meta"})
+                out = {**res, "attempt": job["attempt"]}
+                if job["payload"]:
+                    out["job"] = job["payload"]
+                yield out
+            if poll is None:
+                break
+            time.sleep(poll)
+    finally:
+        stop.set()
+        if pool is not None and pool.started:
+            pool.close()
+        # interruzione (Ctrl-C, errore): i prodotti non conclusi tornano subito in coda
+        if jobs:
+            queue.release(owner)
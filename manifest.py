@@ -0,0 +1,100 @@
+# manifest.py
+# Manifest di un job batch (JSONL append-only) per rendere i run riprendibili:
+# una riga per ogni colore salvato/fallito e per ogni prodotto concluso, scritta appena
+# l'elemento termina. Riaprendo lo stesso file lo stato viene ricostruito e il job salta
+# prodotti e colori già completati, ritentando solo i falliti o mancanti.
+
+from pathlib import Path
+import hashlib, json, os, threading, time
+
+def _file_sha256(path: Path) -> str | None:
+    try:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+    except OSError:
+        return None
+
+def color_key(rec: dict) -> str | None:
+    """Chiave di un risultato per-colore: codice colore, altrimenti nome o file."""
+    color = rec.get("color") or {}
+    if isinstance(color, str):
+        return color  # risultati a target di app.py: il colore è solo il nome
+    return color.get("code") or color.get("name") or rec.get("file")
+
+class JobManifest:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.products = {}  # url -> ultimo record prodotto
+        self.colors = {}    # url -> {chiave colore: ultimo record}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # riga troncata da un crash
+                    self._apply(rec)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "a", encoding="utf-8")
+        if self._f.tell():
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._f.write("\n")  # chiude la riga troncata, le nuove restano leggibili
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _apply(self, rec: dict):
+        if rec.get("type") == "product":
+            self.products[rec["url"]] = rec
+        elif rec.get("type") == "color":
+            self.colors.setdefault(rec["url"], {})[rec["key"]] = rec
+
+    def _append(self, rec: dict):
+        rec["ts"] = time.time()
+        with self._lock:
+            self._apply(rec)
+            self._f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def product_done(self, url: str) -> bool:
+        return (self.products.get(url) or {}).get("status") == "done"
+
+    def done_colors(self, url: str) -> set:
+        return {k for k, rec in (self.colors.get(url) or {}).items() if rec.get("status") == "done"}
+
+    def pending(self, urls):
+        """Filtra (in streaming) le URL il cui prodotto è già completato."""
+        for url in urls:
+            if not self.product_done(url):
+                yield url
+
+    def record_color(self, url: str, sku: str, rec: dict, out_dir: Path | None = None):
+        """Registra un risultato per-colore di `download_all_colors` / `scrape_with_browser`."""
+        ok = bool(rec.get("file")) and rec.get("method") != "failed"
+        digest = rec.get("digest")
+        if ok and not digest and out_dir is not None:
+            digest = _file_sha256(Path(out_dir) / Path(rec["file"]).name)
+        self._append({
+            "type": "color", "url": url, "sku": sku, "key": color_key(rec),
+            "color": rec.get("color"), "status": "done" if ok else "failed",
+            "method": rec.get("method"), "file": rec.get("file"), "sha256": digest,
+            "source_url": rec.get("url"), "reason": rec.get("reason") or rec.get("note"),
+        })
+
+    def record_product(self, url: str, status: str, sku: str = None, error: str = None):
+        """`status`: "done" (tutti i colori ok), "partial" (da ritentare) o "error"."""
+        self._append({"type": "product", "url": url, "sku": sku, "status": status, "error": error})
@@ -0,0 +1,134 @@
+# orchestrator.py
+# Scraping a livelli: prima il percorso HTTP (parse_page + download_all_colors) per ogni
+# prodotto, poi il browser solo per i colori rimasti "failed" o coperti solo da
+# main/thumbs_fallback, cliccando esclusivamente gli swatch con quei codici. I risultati
+# dei due livelli vengono fusi in un unico schema per prodotto:
+#   {"url", "sku", "out_dir", "saved": [record con "tier": "http" | "browser"], "browser": bool}
+# Il batch HTTP continua mentre i worker browser lavorano sui prodotti già passati.
+
+from pathlib import Path
+from concurrent.futures import as_completed
+import os
+
+from manifest import color_key
+from scraper import AUTH_STATE, BATCH_WORKERS, scrape_batch
+
+NEEDS_BROWSER = ("failed", "main/thumbs_fallback")
+
+def browser_todo(saved: list[dict]) -> set | None:
+    """
+    Codici colore da passare al browser. None = tutto il prodotto (c'è un colore da
+    rifare senza codice, quindi non si può scegliere lo swatch).
+    """
+    todo = set()
+    for rec in saved:
+        if rec.get("method") in NEEDS_BROWSER:
+            code = (rec.get("color") or {}).get("code")
+            if not code:
+                return None
+            todo.add(code)
+    return todo
+
+def merge_results(http_res: dict, browser_res: dict | None) -> dict:
+    """Fonde i record: un colore riuscito nel browser sostituisce quello HTTP (fallback/failed)."""
+    out_dir = Path(http_res["out_dir"])
+    by_key = {}
+    for rec in http_res.get("saved") or []:
+        by_key[color_key(rec) or id(rec)] = {**rec, "tier": "http"}
+    for rec in (browser_res or {}).get("results") or []:
+        key = color_key(rec)
+        old = by_key.get(key)
+        ok = rec.get("file") and rec.get("method") != "failed"
+        if old is not None and not ok:
+            continue  # il browser non ha fatto meglio: resta il record HTTP
+        if old is not None and old.get("file") and old["file"] != rec.get("file"):
+            # il file di fallback (immagine di un altro colore) non serve più
+            try:
+                os.unlink(out_dir / Path(old["file"]).name)
+            except OSError:
+                pass
+        by_key[key] = {**rec, "tier": "browser"}
+    res = {k: v for k, v in http_res.items() if k != "saved"}
+    res["saved"] = list(by_key.values())
+    res["browser"] = browser_res is not None
+    if browser_res is not None and "error" in browser_res:
+        res["browser_error"] = browser_res["error"]
+    return res
+
+def _record(manifest, res: dict):
+    if "error" in res:
+        manifest.record_product(res["url"], "error", error=res["error"])
+        return
+    for rec in res["saved"]:
+        manifest.record_color(res["url"], res["sku"], rec, res["out_dir"])
+    failed = any(rec.get("method") == "failed" for rec in res["saved"])
+    manifest.record_product(res["url"], "partial" if failed else "done", sku=res["sku"])
+
+def scrape_tiered(urls, out_root: Path, username: str = None, password: str = None, try_hd: bool = True,
+                  http_workers: int = BATCH_WORKERS, browser_workers: int = 2, cache=None, manifest=None,
+                  fast_parse: bool = False, auth_state: Path = AUTH_STATE, lean: bool | dict = True, pool=None,
+                  **browser_kwargs):
+    """
+    Generatore di risultati fusi (ordine di completamento). Il BrowserPool parte solo al
+    primo prodotto che ne ha bisogno. `browser_kwargs` vanno al handler del browser
+    (es. `shards`, `intercept`, `wait_ms`). Con `manifest` i prodotti completati vengono
+    saltati e l'esito viene registrato solo dopo la fusione: se il run si interrompe
+    mentre il browser lavora, al riavvio il prodotto viene rifatto. Con `pool` si usa un
+    BrowserPool del chiamante (avviato qui se serve, mai chiuso): es. jobqueue.run_worker.
+    """
+    out_root = Path(out_root)
+    if manifest is not None:
+        urls = manifest.pending(urls)
+    own_pool = pool is None
+    in_browser = {}  # Future -> risultato HTTP
+
+    def finish(res: dict) -> dict:
+        if manifest is not None:
+            _record(manifest, res)
+        return res
+
+    def drain(block: bool):
+        for fut in (as_completed(list(in_browser)) if block else [f for f in in_browser if f.done()]):
+            http_res = in_browser.pop(fut)
+            try:
+                browser_res = fut.result()
+            except Exception as e:
+                browser_res = {"error": f"{type(e).__name__}: {e}", "results": []}
+            if "out_dir" not in http_res:
+                # prodotto fallito in HTTP: vale solo il risultato del browser
+                res = {k: v for k, v in browser_res.items() if k != "results"}
+                saved = [{**rec, "tier": "browser"} for rec in browser_res.get("results") or []]
+                yield finish({"url": http_res["url"], **res, "saved": saved, "out_dir": http_res["browser_dir"],
+                              "browser": True})
+            else:
+                yield finish(merge_results(http_res, browser_res))
+
+    try:
+        for res in scrape_batch(urls, out_root, try_hd=try_hd, max_workers=http_workers, auth_state=auth_state,
+                                cache=cache, fast_parse=fast_parse):
+            if res.get("unchanged"):
+                yield res
+                continue
+            if "error" in res:
+                # pagina non leggibile via HTTP: tutto il prodotto al browser
+                from browser_scraper import slug_dir
+                todo, out_dir = None, slug_dir(out_root, res["url"])
+                res["browser_dir"] = str(out_dir)
+            else:
+                todo, out_dir = browser_todo(res["saved"]), Path(res["out_dir"])
+                if todo == set():
+                    yield finish(merge_results(res, None))
+                    continue
+            if pool is None:
+                from browser_scraper import BrowserPool  # Playwright solo se serve davvero
+                pool = BrowserPool(size=browser_workers, username=username, password=password,
+                                   auth_state=auth_state, lean=lean)
+            if not pool.started:
+                pool.start()
+            fut = pool.submit(res["url"], out_dir, only_codes=todo, cache=cache, **browser_kwargs)
+            in_browser[fut] = res
+            yield from drain(block=False)
+        yield from drain(block=True)
+    finally:
+        if own_pool and pool is not None:
+            pool.close()
@@ -0,0 +1,134 @@
+# postprocess.py
+# Rendition delle immagini salvate (resize, WebP/AVIF, miniatura quadrata) in un pool di
+# processi: il lavoro CPU usa tutti i core mentre i thread di rete continuano a scaricare.
+# Ogni immagine viene inviata al pool appena salvata (submit non bloccante); i path delle
+# rendition finiscono nel record in `renditions` ({nome: path relativo a out_dir}).
+#
+#   with Postprocessor() as pp:
+#       for res in scrape_batch(urls, out_root, postprocess=pp):
+#           ...  # i record di res["saved"] hanno già "renditions"
+
+from pathlib import Path
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing, os, tempfile, threading
+
+RENDITIONS = [
+    {"name": "web", "max_edge": 1600, "format": "WEBP", "quality": 82},
+    {"name": "thumb", "square": 400, "fit": "pad", "format": "JPEG", "quality": 85},
+]
+
+_EXT = {"WEBP": ".webp", "AVIF": ".avif", "JPEG": ".jpg", "PNG": ".png"}
+
+def _render_one(im, spec: dict):
+    from PIL import Image, ImageOps
+    if spec.get("max_edge"):
+        im = im.copy()
+        im.thumbnail((spec["max_edge"], spec["max_edge"]), Image.LANCZOS)  # mai ingrandita
+    if spec.get("square"):
+        size = (spec["square"], spec["square"])
+        if spec.get("fit") == "crop":
+            im = ImageOps.fit(im, size, Image.LANCZOS)
+        else:
+            im = ImageOps.pad(im.convert("RGB"), size, Image.LANCZOS, color=spec.get("background", "white"))
+    fmt = spec.get("format", "JPEG").upper()
+    if fmt == "JPEG" and im.mode != "RGB":
+        im = im.convert("RGB")
+    return im, fmt
+
+def render_file(src: str, dest_root: str, renditions: list[dict]) -> dict:
+    """
+    Eseguita nei processi del pool: crea le rendition di `src` in
+    `dest_root/<nome rendition>/<nome file><ext>`. Ritorna {nome: path | {"error": ...}}.
+    """
+    from PIL import Image, ImageOps
+    out = {}
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        im.load()
+        for spec in renditions:
+            try:
+                r, fmt = _render_one(im, spec)
+                dest = Path(dest_root) / spec["name"] / (Path(src).stem + _EXT.get(fmt, "." + fmt.lower()))
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".pp-", suffix=".part")
+                with os.fdopen(fd, "wb") as f:
+                    r.save(f, fmt, quality=spec.get("quality", 85))
+                os.replace(tmp, dest)
+                out[spec["name"]] = str(dest)
+            except Exception as e:
+                out[spec["name"]] = {"error": f"{type(e).__name__}: {e}"}
+    return out
+
+class Postprocessor:
+    """
+    Pool di processi per le rendition. `submit(rec, out_dir)` non blocca mai: il record
+    viene completato da una callback quando il processo ha finito; `wait(futures)` serve
+    solo a chi consuma i risultati (non ai worker di I/O).
+    """
+
+    def __init__(self, renditions: list[dict] = None, workers: int = None, subdir: str = "renditions"):
+        self.renditions = renditions or RENDITIONS
+        self.workers = workers
+        self.subdir = subdir
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # niente fork: il pool nasce da thread di rete/Playwright e un figlio forkato
+                # erediterebbe lock tenuti da altri thread
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("forkserver"))
+            return self._pool
+
+    def submit(self, rec: dict, out_dir: Path):
+        """Invia al pool il file di `rec` (se c'è); ritorna il Future o None."""
+        if not rec.get("file") or rec.get("method") == "failed":
+            return None
+        out_dir = Path(out_dir)
+        src = out_dir / Path(rec["file"]).name
+        pool = self._executor()
+        try:
+            fut = pool.submit(render_file, str(src), str(out_dir / self.subdir), self.renditions)
+        except BrokenProcessPool:
+            # il prossimo submit riparte con un pool nuovo; questo record resta senza rendition
+            with self._lock:
+                if self._pool is pool:
+                    self._pool = None
+            raise
+        # Future "record completato": si risolve dopo la callback, non solo a processo finito
+        attached = Future()
+
+        def attach(f):
+            try:
+                done = f.result()
+                rec["renditions"] = {name: (os.path.relpath(v, out_dir) if isinstance(v, str) else v)
+                                     for name, v in done.items()}
+            except Exception as e:
+                rec["renditions_error"] = f"{type(e).__name__}: {e}"
+            attached.set_result(rec)
+
+        fut.add_done_callback(attach)
+        return attached
+
+    def submit_all(self, recs: list[dict], out_dir: Path) -> list:
+        return [f for f in (self.submit(rec, out_dir) for rec in recs) if f is not None]
+
+    @staticmethod
+    def wait(futures):
+        if futures:
+            wait(futures)
+
+    def close(self, wait: bool = True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,207 @@
+# ratelimit.py
+# Controllo adattivo di concorrenza per host (AIMD), condiviso da tutti i percorsi HTTP:
+# - al massimo `limit` richieste in volo per host; `limit` cresce di ~1 per "giro" finché
+#   latenza ed errori restano sani, e si dimezza su 429/503, errori di rete o latenza alta
+# - su 429/503 l'host viene bloccato per il tempo indicato da Retry-After (o backoff esponenziale)
+# - ControlledSession fa passare ogni richiesta requests dal controller e ritenta i 429/503;
+#   per Playwright (`page.request`) usare `with controller.slot(url) as slot: ... slot.record(status, retry_after)`
+
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import threading, time, urllib.parse, weakref
+
+import requests
+
+THROTTLE_STATUSES = (429, 503)
+LATENCY_SLACK = 0.1  # secondi: sotto questa soglia il jitter di latenza non conta come congestione
+
+def parse_retry_after(value) -> float | None:
+    """Secondi di attesa da un header Retry-After (delta in secondi o data HTTP)."""
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class _HostState:
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.backoff = 1.0
+        self.base_latency = None
+        self.last_decrease = 0.0
+
+class _Slot:
+    """Un posto "in volo" per un host; `record` registra l'esito, `release` libera il posto."""
+
+    def __init__(self, controller, host: str):
+        self._controller = controller
+        self.host = host
+        self.start = time.monotonic()
+        self.recorded = False
+        self.released = False
+        self._lock = threading.Lock()  # release può arrivare da close, release_conn e dal GC
+
+    def record(self, status: int | None = None, retry_after=None, error: bool = False):
+        if not self.recorded:
+            self.recorded = True
+            self._controller._record(self.host, time.monotonic() - self.start, status, retry_after, error)
+
+    def release(self):
+        with self._lock:
+            if self.released:
+                return
+            self.released = True
+        self._controller._release(self.host)
+
+class RateController:
+    def __init__(self, initial: float = 4, min_limit: float = 1, max_limit: float = 32,
+                 decrease: float = 0.5, latency_factor: float = 3.0, max_backoff: float = 60.0):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.max_backoff = max_backoff
+        self._hosts = {}
+        self._cond = threading.Condition()
+
+    def _host(self, host: str) -> _HostState:
+        h = self._hosts.get(host)
+        if h is None:
+            h = self._hosts[host] = _HostState(self.initial)
+        return h
+
+    def acquire(self, url: str) -> _Slot:
+        """Attende un posto libero per l'host di `url` (rispettando eventuali blocchi Retry-After)."""
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._cond:
+            h = self._host(host)
+            while True:
+                now = time.monotonic()
+                if now < h.blocked_until:
+                    self._cond.wait(h.blocked_until - now)
+                elif h.in_flight >= max(1, int(h.limit)):
+                    self._cond.wait()
+                else:
+                    break
+            h.in_flight += 1
+        return _Slot(self, host)
+
+    @contextmanager
+    def slot(self, url: str):
+        s = self.acquire(url)
+        try:
+            yield s
+        except Exception:
+            s.record(error=True)
+            raise
+        finally:
+            s.release()
+
+    def _release(self, host: str):
+        with self._cond:
+            self._hosts[host].in_flight -= 1
+            self._cond.notify_all()
+
+    def _decrease(self, h: _HostState, now: float):
+        # un solo dimezzamento per "giro": le risposte già in volo non devono farlo crollare
+        if now - h.last_decrease >= max(1.0, h.base_latency or 0.0):
+            h.limit = max(self.min_limit, h.limit * self.decrease)
+            h.last_decrease = now
+
+    def _record(self, host: str, latency: float, status, retry_after, error: bool):
+        with self._cond:
+            h = self._host(host)
+            now = time.monotonic()
+            if status in THROTTLE_STATUSES:
+                delay = parse_retry_after(retry_after)
+                if delay is None:
+                    delay = h.backoff
+                    h.backoff = min(self.max_backoff, h.backoff * 2)
+                h.blocked_until = max(h.blocked_until, now + min(delay, self.max_backoff))
+                self._decrease(h, now)
+            elif error or (status is not None and status >= 500):
+                self._decrease(h, now)
+            else:
+                h.backoff = 1.0
+                h.base_latency = latency if h.base_latency is None else min(latency, h.base_latency * 1.01)
+                if latency > self.latency_factor * h.base_latency + LATENCY_SLACK:
+                    self._decrease(h, now)
+                else:
+                    # additive increase: ~+1 ogni `limit` risposte sane
+                    h.limit = min(self.max_limit, h.limit + 1.0 / h.limit)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {host: {"limit": round(h.limit, 2), "in_flight": h.in_flight,
+                           "blocked_for": max(0.0, round(h.blocked_until - time.monotonic(), 2))}
+                    for host, h in self._hosts.items()}
+
+# controller condiviso di default (tutte le sessioni di scraper._session e le richieste Playwright)
+DEFAULT_CONTROLLER = RateController()
+
+class ControlledSession(requests.Session):
+    """
+    Session requests in cui ogni richiesta passa dal RateController. Con `stream=True`
+    il posto resta occupato finché il body non è letto tutto, la risposta chiusa (meglio
+    `with session.get(...) as r`) o raccolta dal GC.
+    I 429/503 vengono ritentati (fino a `throttle_retries`) dopo l'attesa imposta dal controller.
+    """
+
+    def __init__(self, controller: RateController = None, throttle_retries: int = 3):
+        super().__init__()
+        self.controller = controller or DEFAULT_CONTROLLER
+        self.throttle_retries = throttle_retries
+
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(self.throttle_retries + 1):
+            slot = self.controller.acquire(url)
+            try:
+                resp = super().request(method, url, *args, **kwargs)
+            except Exception:
+                slot.record(error=True)
+                slot.release()
+                raise
+            slot.record(resp.status_code, resp.headers.get("Retry-After"))
+            throttled = resp.status_code in THROTTLE_STATUSES
+            if kwargs.get("stream") and not (throttled and attempt < self.throttle_retries):
+                _release_with_response(resp, slot)
+                return resp
+            slot.release()
+            if not throttled or attempt == self.throttle_retries:
+                return resp
+            resp.close()
+        return resp
+
+def _release_with_response(resp: requests.Response, slot: _Slot):
+    """
+    Libera il posto di una risposta `stream=True` appena il body è stato letto tutto o la
+    connessione torna al pool (urllib3 chiama `raw.release_conn`), su `close()`, o al più
+    tardi quando la risposta viene raccolta dal GC. `slot.release` è idempotente.
+    """
+    raw_release = getattr(resp.raw, "release_conn", None)
+    if raw_release is not None:
+        def release_conn_and_slot():
+            try:
+                raw_release()
+            finally:
+                slot.release()
+
+        resp.raw.release_conn = release_conn_and_slot
+    close = resp.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            slot.release()
+
+    resp.close = close_and_release
+    weakref.finalize(resp, slot.release)
@@ -1,9 +1,14 @@
-from bs4 import BeautifulSoup
-import requests, re, os, urllib.parse, mimetypes, time
+import requests, re, os, urllib.parse, mimetypes, time, hashlib, json, shutil, tempfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from ratelimit import ControlledSession, RateController, DEFAULT_CONTROLLER
+from manifest import color_key
+from imgmeta import HEADER_BYTES, JPEG_MAX_JUMPS, JPEG_SEGMENT_BYTES, image_size, jpeg_scan, rank_key
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
@@ -23,14 +28,45 @@ SEL_SWATCH = "#js_availablecolorsheader .wrapperSwitchColore a.js_colorswitch, a
 DOWNLOAD_RE = re.compile(r"""href\s*=\s*["'](?P<url>/product_photo_download\?[^"']+)["']""", re.I)
 ID_IN_QUERY_RE = re.compile(r"[?&](?:id|fid1|file_id)=(\d+)")
 
-def _session() -> requests.Session:
-    s = requests.Session()
-    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
-    s.mount("https://", HTTPAdapter(max_retries=retries))
-    s.mount("http://", HTTPAdapter(max_retries=retries))
+# storage_state di Playwright (cookie + localStorage) salvato dopo il login, vedi browser_scraper
+AUTH_STATE = Path(".auth/innovativewear_state.json")
+
+CHUNK_SIZE = 64 * 1024  # i download vanno su disco a chunk: memoria costante per file
+
+PROBE_BYTES = HEADER_BYTES  # byte chiesti per sondare un candidato (bastano per gli header immagine)
+PROBE_WORKERS = 8
+
+def _session(pool_size: int = 10, controller: RateController | None = None) -> requests.Session:
+    # 429/503 + Retry-After li gestisce il RateController (condiviso fra tutte le sessioni);
+    # urllib3 ritenta solo gli altri 5xx
+    s = ControlledSession(controller or DEFAULT_CONTROLLER)
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 504])
+    s.mount("https://", HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size))
+    s.mount("http://", HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size))
     s.headers.update(HEADERS)
     return s
 
+def apply_cookies(session: requests.Session, cookies: list[dict]) -> int:
+    """Copia nella sessione requests i cookie in formato Playwright (context.cookies() / storage_state)."""
+    n = 0
+    for c in cookies:
+        expires = c.get("expires")
+        session.cookies.set(
+            c["name"], c["value"],
+            domain=c.get("domain", ""), path=c.get("path", "/"), secure=bool(c.get("secure")),
+            expires=int(expires) if expires and expires > 0 else None,
+        )
+        n += 1
+    return n
+
+def load_auth_cookies(session: requests.Session, path: Path = AUTH_STATE) -> bool:
+    """Carica i cookie del login salvato (se presente), così i download HD autenticati non passano dal browser."""
+    try:
+        state = json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return apply_cookies(session, state.get("cookies", [])) > 0
+
 def _get(session: requests.Session, url: str):
     resp = session.get(url, timeout=30, allow_redirects=True)
     resp.raise_for_status()
@@ -44,33 +80,100 @@ def filename_sanitize(name: str) -> str:
     name = re.sub(r"\s+", " ", name)
     return name
 
-def parse_page(session: requests.Session, url: str):
-    html = _get(session, url).text
+def _extract_bs4(html: str):
+    """Estrazione completa con BeautifulSoup: (campi grezzi per `_build_meta`, soup)."""
+    from bs4 import BeautifulSoup  # import pigro: niente bs4/lxml per chi non fa parsing
     soup = BeautifulSoup(html, "lxml")
-
-    # SKU
-    sku = "SKU"
     sku_el = soup.select_one(SEL_SKU)
-    if sku_el:
-        sku = sku_el.get_text(strip=True)
+    t_el = soup.select_one(SEL_TITLE)
+    color_label_el = soup.select_one(SEL_COLOR_LABEL)
+    img_el = soup.select_one(SEL_MAIN_IMG)
+    hd_el = soup.select_one(SEL_HD_LINK)
+    raw = {
+        "sku": sku_el.get_text(strip=True) if sku_el else None,
+        "title": t_el.get_text(strip=True) if t_el else None,
+        "color_label": color_label_el.get_text(separator=" ", strip=True) if color_label_el else None,
+        "swatches": [(a.get("title") or "", a.get_text(strip=True), a.get("data-color"), a.get("data-fid1"))
+                     for a in soup.select(SEL_SWATCH)],
+        "main_src": img_el.get("src") if img_el else None,
+        "thumbs": [t.get("src") for t in soup.select(SEL_THUMBS_IMG)],
+        "hd_href": hd_el.get("href") if hd_el else None,
+    }
+    return raw, soup
+
+# XPath equivalenti ai selettori SEL_* (compilati alla prima chiamata di `_extract_lxml`)
+_XPATHS = None
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+def _compile_xpaths():
+    from lxml import etree
+    c = _has_class
+    return {
+        "sku": etree.XPath(f"(//*[(self::h2 and ({c('prodCode')} or {c('prodcode')}))"
+                           f" or ({c('prodCode')} and ancestor::h2)])[1]"),
+        "title": etree.XPath(f"(//*[self::h1 or {c('product-title')}])[1]"),
+        "color_label": etree.XPath(f"(//*[{c('colorLabel')}])[1]"),
+        "swatches": etree.XPath(
+            f"//a[({c('js_colorswitch')} and ancestor::*[{c('wrapperSwitchColore')}"
+            f" and ancestor::*[@id='js_availablecolorsheader']]) or {c('colorSwitch')}]"),
+        "main": etree.XPath(f"(//img[ancestor::*[@id='js_productMainPhoto'] or ancestor::*[{c('wrapperFoto')}]])[1]"),
+        "thumbs": etree.XPath(f"//img[({c('js_productThumb')} and ancestor::*[@id='js_productThumbs'])"
+                              f" or ancestor::*[{c('wrapperThumbs')}]]"),
+        "hd": etree.XPath(f"(//a[{c('js_downloadPhoto')} and contains(@href, 'product_photo_download')])[1]"),
+        # come get_text() di bs4: solo nodi testo, niente script/style/commenti
+        "text": etree.XPath("descendant::text()[not(ancestor::script) and not(ancestor::style)]"),
+    }
+
+def _extract_lxml(html: str):
+    """
+    Estrazione veloce: parser HTML di lxml + XPath precompilate, nessun albero bs4.
+    Stessi campi (e quindi stesso `meta`) di `_extract_bs4`; ritorna (campi, root lxml).
+    """
+    global _XPATHS
+    from lxml import etree
+    if _XPATHS is None:
+        _XPATHS = _compile_xpaths()
+    x = _XPATHS
+    root = etree.fromstring(html.encode("utf-8"), etree.HTMLParser(encoding="utf-8"))
+    if root is None:
+        root = etree.Element("html")
+
+    def text(el, sep=""):
+        return sep.join(t.strip() for t in x["text"](el) if t.strip())
+
+    def first(name):
+        found = x[name](root)
+        return found[0] if found else None
+
+    sku_el, t_el, label_el, img_el, hd_el = (first(n) for n in ("sku", "title", "color_label", "main", "hd"))
+    raw = {
+        "sku": text(sku_el) if sku_el is not None else None,
+        "title": text(t_el) if t_el is not None else None,
+        "color_label": text(label_el, " ") if label_el is not None else None,
+        "swatches": [(a.get("title") or "", text(a), a.get("data-color"), a.get("data-fid1"))
+                     for a in x["swatches"](root)],
+        "main_src": img_el.get("src") if img_el is not None else None,
+        "thumbs": [t.get("src") for t in x["thumbs"](root)],
+        "hd_href": hd_el.get("href") if hd_el is not None else None,
+    }
+    return raw, root
+
+def _build_meta(url: str, html: str, raw: dict) -> dict:
+    # SKU
+    if raw["sku"] is not None:
+        sku = raw["sku"]
     else:
         # fallback: deduci da URL (ultima parte)
         slug = urllib.parse.urlparse(url).path.rstrip("/").split("/")[-1]
         sku = slug.upper()
     sku = filename_sanitize(sku)
 
-    # Title (best effort)
-    title = None
-    t_el = soup.select_one(SEL_TITLE)
-    if t_el:
-        title = t_el.get_text(strip=True)
-
-    # colore corrente (label)
+    # colore corrente (label), es. "Black (BLK)"
     current_color = None
-    color_label_el = soup.select_one(SEL_COLOR_LABEL)
-    if color_label_el:
-        # Esempio: "Black (BLK)"
-        txt = color_label_el.get_text(separator=" ", strip=True)
+    txt = raw["color_label"]
+    if txt is not None:
         m = re.search(r"(.+?)\s*\(([^)]+)\)", txt)
         if m:
             current_color = {"name": m.group(1).strip(), "code": m.group(2).strip()}
@@ -79,43 +182,22 @@ def parse_page(session: requests.Session, url: str):
 
     # swatches
     colors = []
-    for a in soup.select(SEL_SWATCH):
-        title_attr = a.get("title") or ""
-        txt = title_attr.strip() or a.get_text(strip=True)
-        name, code = None, None
+    for title_attr, a_text, data_color, fid1 in raw["swatches"]:
+        txt = title_attr.strip() or a_text
         m = re.search(r"(.+?)\s*\(([^)]+)\)", txt)
         if m:
             name, code = m.group(1).strip(), m.group(2).strip()
         else:
-            name = txt
-            code = a.get("data-color") or None
-        fid1 = a.get("data-fid1") or None
-        colors.append({"name": name, "code": code, "fid1": fid1})
-
-    # main image
-    main_img = None
-    img_el = soup.select_one(SEL_MAIN_IMG)
-    if img_el and img_el.get("src"):
-        main_img = absolute(url, img_el["src"])
-
-    # thumbs
-    thumbs = []
-    for t in soup.select(SEL_THUMBS_IMG):
-        src = t.get("src")
-        if src:
-            thumbs.append(absolute(url, src))
+            name, code = txt, data_color or None
+        colors.append({"name": name, "code": code, "fid1": fid1 or None})
 
+    main_img = absolute(url, raw["main_src"]) if raw["main_src"] else None
+    thumbs = [absolute(url, src) for src in raw["thumbs"] if src]
     # link HD (per colore selezionato attuale)
-    hd_link = None
-    hd_el = soup.select_one(SEL_HD_LINK)
-    if hd_el and hd_el.get("href"):
-        hd_link = absolute(url, hd_el["href"])
+    hd_link = absolute(url, raw["hd_href"]) if raw["hd_href"] else None
 
     # tutti i possibili link di download presenti nell'HTML
-    all_hd_links = []
-    for m in DOWNLOAD_RE.finditer(html):
-        all_hd_links.append(absolute(url, m.group("url")))
-    all_hd_links = list(dict.fromkeys(all_hd_links))
+    all_hd_links = list(dict.fromkeys(absolute(url, m.group("url")) for m in DOWNLOAD_RE.finditer(html)))
 
     # mappa id->link
     id_to_link = {}
@@ -124,10 +206,10 @@ def parse_page(session: requests.Session, url: str):
         if m:
             id_to_link[m.group(1)] = l
 
-    return {
+    meta = {
         "url": url,
         "sku": sku,
-        "title": title,
+        "title": raw["title"],
         "current_color": current_color,
         "colors": colors,
         "main_img": main_img,
@@ -136,7 +218,175 @@ def parse_page(session: requests.Session, url: str):
         "all_hd_links": all_hd_links,
         "id_to_link": id_to_link,
         "raw_html_len": len(html),
-    }, soup
+    }
+    meta["fingerprint"], meta["color_fingerprints"] = page_fingerprint(meta)
+    return meta
+
+def parse_page(session: requests.Session, url: str, html: str | None = None, fast: bool = False):
+    """
+    (meta, documento). Con `fast=True` usa l'estrattore lxml/XPath (`_extract_lxml`) e il
+    secondo valore è la root lxml invece della soup; il `meta` è identico.
+    """
+    if html is None:
+        html = _get(session, url).text
+    raw, doc = (_extract_lxml if fast else _extract_bs4)(html)
+    return _build_meta(url, html, raw), doc
+
+def _digest(obj) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def page_fingerprint(meta: dict) -> tuple[str, dict]:
+    """
+    Impronta stabile dei dati estratti che contano per il download (SKU, swatch con
+    code/fid1, main_img, thumbs, link HD), più un'impronta per colore: chiave colore ->
+    hash di swatch + sorgente immagine (link HD del suo fid1, altrimenti main/thumbs).
+    """
+    fallback = [meta.get("main_img"), meta.get("thumbs") or []]
+    color_fps = {}
+    for c in meta.get("colors") or []:
+        key = c.get("code") or c.get("name")
+        if key:
+            hd = (meta.get("id_to_link") or {}).get(str(c.get("fid1") or ""))
+            color_fps[key] = _digest([c.get("name"), c.get("code"), c.get("fid1"), hd or fallback])
+    fp = _digest({
+        "sku": meta.get("sku"),
+        "colors": [[c.get("code"), c.get("fid1")] for c in meta.get("colors") or []],
+        "main_img": meta.get("main_img"),
+        "thumbs": meta.get("thumbs") or [],
+        "all_hd_links": meta.get("all_hd_links") or [],
+    })
+    return fp, color_fps
+
+def fetch_page(session: requests.Session, url: str, etag: str = None, last_modified: str = None):
+    """GET (condizionale se ci sono validatori) della pagina: (html | None se 304, etag, last_modified)."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    resp = session.get(url, headers=headers, timeout=30, allow_redirects=True)
+    if resp.status_code == 304 and headers:
+        return None, etag, last_modified
+    resp.raise_for_status()
+    return resp.text, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+
+def stream_to_file(resp: requests.Response, tmp_dir: Path) -> dict:
+    """
+    Scrive il body di `resp` (richiesta con stream=True) in un temporaneo in `tmp_dir`,
+    calcolando man mano estensione (dal primo chunk), dimensione e sha256.
+    """
+    tmp_dir = Path(tmp_dir)
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=tmp_dir, prefix=".dl-", suffix=".part")
+    h = hashlib.sha256()
+    size, ext = 0, None
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if ext is None:
+                    ext = guess_ext_from_bytes(chunk)
+                h.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return {"tmp": Path(tmp), "ext": ext or ".jpg", "size": size, "sha256": h.hexdigest(),
+            "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified")}
+
+def stream_download(session: requests.Session, url: str, tmp_dir: Path) -> dict | None:
+    """Come `try_download`, ma in streaming su un temporaneo in `tmp_dir` (vedi `commit_download`)."""
+    try:
+        with session.get(url, timeout=45, allow_redirects=True, stream=True) as r:
+            ctype = r.headers.get("Content-Type", "").lower()
+            if r.status_code != 200 or "text/html" in ctype:
+                return None
+            info = stream_to_file(r, tmp_dir)
+    except Exception:
+        return None
+    if not info["size"]:
+        discard_download(info)
+        return None
+    info["url"] = url
+    return info
+
+def copy_atomic(src: Path, dest: Path) -> Path:
+    """
+    Copia `src` in un temporaneo accanto a `dest` e lo rinomina: `dest` viene sostituito,
+    mai riscritto sul posto (potrebbe essere un hardlink a un blob della cache).
+    """
+    dest = Path(dest)
+    fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".dl-", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f, open(src, "rb") as s:
+            shutil.copyfileobj(s, f, CHUNK_SIZE)
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    return dest
+
+def commit_download(info: dict, dest: Path) -> Path:
+    """
+    Rinomina atomicamente il temporaneo in `dest` (stesso filesystem di `tmp_dir`).
+    Se il download è già stato salvato (stessa immagine per più colori) ne fa una copia.
+    """
+    dest = Path(dest)
+    if info.get("path"):
+        if Path(info["path"]) != dest:
+            copy_atomic(info["path"], dest)
+        return dest
+    os.replace(info["tmp"], dest)
+    info["path"] = dest
+    return dest
+
+def discard_download(info: dict | None):
+    if info and not info.get("path"):
+        try:
+            os.unlink(info["tmp"])
+        except OSError:
+            pass
+
+def hd_link_template(id_to_link: dict) -> str | None:
+    """Template del link HD ricavato da uno osservato nella pagina: l'id in query diventa {fid}."""
+    for link in id_to_link.values():
+        m = ID_IN_QUERY_RE.search(link)
+        if m:
+            return link[:m.start(1)] + "{fid}" + link[m.end(1):]
+    return None
+
+def resolve_hd_links(meta: dict) -> dict:
+    """
+    id -> link product_photo_download per tutti i colori, senza browser: ai link presenti
+    nell'HTML si aggiungono quelli costruiti dal template per ogni `fid1` degli swatch.
+    """
+    id_to_link = dict(meta.get("id_to_link") or {})
+    template = hd_link_template(id_to_link)
+    if template is None:
+        return id_to_link
+    for c in meta.get("colors") or []:
+        fid = str(c.get("fid1") or "")
+        if fid and fid not in id_to_link:
+            id_to_link[fid] = template.replace("{fid}", fid)
+    return id_to_link
+
+def fetch_all(session: requests.Session, id_to_link: dict, max_workers: int = PROBE_WORKERS, fetch=None):
+    """
+    Scarica in parallelo {id: link}; ritorna [(id, link, risultato)] nell'ordine di input.
+    `fetch(session, url)` di default è `try_download` (bytes|None).
+    """
+    fetch = fetch or try_download
+    items = list(id_to_link.items())
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as ex:
+        datas = ex.map(lambda kv: fetch(session, kv[1]), items)
+        return [(fid, link, data) for (fid, link), data in zip(items, datas)]
 
 def try_download(session: requests.Session, url: str) -> bytes | None:
     try:
@@ -148,6 +398,80 @@ def try_download(session: requests.Session, url: str) -> bytes | None:
         return None
     return None
 
+def probe_url(session: requests.Session, url: str) -> dict:
+    """Sonda un candidato senza scaricarlo: HEAD (se supportato) + GET dei primi PROBE_BYTES."""
+    info = {"url": url, "ok": False, "status": None, "content_type": None, "length": None, "dims": None}
+    try:
+        r = session.head(url, timeout=15, allow_redirects=True)
+        if r.status_code not in (405, 501):
+            info["status"] = r.status_code
+            info["content_type"] = r.headers.get("Content-Type", "").lower()
+            if r.status_code != 200 or "text/html" in info["content_type"]:
+                return info
+        r = session.get(url, headers={"Range": f"bytes=0-{PROBE_BYTES - 1}"}, timeout=30,
+                        allow_redirects=True, stream=True)
+        with r:
+            info["status"] = r.status_code
+            info["content_type"] = r.headers.get("Content-Type", "").lower()
+            if r.status_code not in (200, 206) or "text/html" in info["content_type"]:
+                return info
+            # ci si ferma appena l'header dà le dimensioni: dai perdenti si leggono pochi KB
+            head, dims = b"", None
+            for chunk in r.iter_content(4096):
+                head += chunk
+                dims = image_size(head)
+                if dims or len(head) >= PROBE_BYTES:
+                    break
+        if dims is None and head[:2] == b"\xff\xd8" and r.status_code == 206:
+            dims = _probe_jpeg_tail(session, url, head)
+        # Content-Range: bytes 0-16383/123456 -> dimensione totale
+        m = re.search(r"/(\d+)$", r.headers.get("Content-Range", ""))
+        if m:
+            info["length"] = int(m.group(1))
+        elif r.status_code == 200 and r.headers.get("Content-Length", "").isdigit():
+            info["length"] = int(r.headers["Content-Length"])
+        info["dims"] = dims
+        info["ok"] = True
+    except Exception:
+        pass
+    return info
+
+def _probe_jpeg_tail(session: requests.Session, url: str, head: bytes):
+    """SOF oltre i primi PROBE_BYTES (EXIF/ICC grandi): salta di segmento in segmento con GET parziali."""
+    dims, offset = jpeg_scan(head)
+    for _ in range(JPEG_MAX_JUMPS):
+        if dims or offset is None:
+            break
+        r = session.get(url, headers={"Range": f"bytes={offset}-{offset + JPEG_SEGMENT_BYTES - 1}"}, timeout=30,
+                        allow_redirects=True, stream=True)
+        with r:
+            if r.status_code != 206:
+                return None  # Range ignorato: non si scarica il file intero per le dimensioni
+            chunk = r.content[:JPEG_SEGMENT_BYTES]
+        dims, offset = jpeg_scan(chunk, offset, base=offset)
+    return dims
+
+def probe_candidates(session: requests.Session, urls: list[str], max_workers: int = PROBE_WORKERS) -> dict:
+    """Sonda tutti i candidati in parallelo; ritorna {url: info}."""
+    out = {}
+    if not urls:
+        return out
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as ex:
+        futures = {ex.submit(probe_url, session, u): u for u in urls}
+        for fut in as_completed(futures):
+            out[futures[fut]] = fut.result()
+    return out
+
+def rank_candidates(session: requests.Session, urls: list[str]) -> list[str]:
+    """
+    URL ordinate dalla migliore (imgmeta.rank_key sui probe) alla peggiore; quelle non
+    raggiungibili in fondo, nell'ordine originale.
+    """
+    probes = probe_candidates(session, urls)
+    ok = sorted((probes[u] for u in urls if probes[u]["ok"]), key=rank_key, reverse=True)
+    ranked = [p["url"] for p in ok]
+    return ranked + [u for u in urls if u not in ranked]
+
 def enlarge_url_candidates(src_url: str) -> list[str]:
     out = [src_url]
     parsed = urllib.parse.urlparse(src_url)
@@ -174,23 +498,61 @@ def guess_ext_from_bytes(data: bytes, default=".jpg") -> str:
         return ".webp"
     return default
 
-def download_all_colors(url: str, meta: dict, out_dir: Path, try_hd: bool = True):
-    session = _session()
-    _ = session.get(url)  # warm cookies
+def download_all_colors(url: str, meta: dict, out_dir: Path, try_hd: bool = True,
+                        session: requests.Session | None = None, cache=None,
+                        skip_codes=None, on_item=None, sink=None):
+    """
+    Scarica le immagini di tutti i colori in `out_dir`. Con `cache` (image_cache.ImageCache)
+    i download sono condizionali e i file sono hardlink ai blob della cache.
+    `skip_codes`: chiavi colore già completate (vedi manifest.color_key), che non vengono
+    riscaricate; `on_item(rec)` viene chiamato appena ogni risultato è pronto.
+    Con `sink` (vedi sinks.py) i file vanno nel sink come "<nome di out_dir>/<file>",
+    ad es. dritti in uno ZIP, invece che in `out_dir`.
+    """
+    if session is None:
+        session = _session()
+        load_auth_cookies(session)
+        _ = session.get(url)  # warm cookies
 
     saved = []
-
-    def save_image_bytes(data: bytes, base_name: str):
-        ext = guess_ext_from_bytes(data)
-        fname = f"{filename_sanitize(base_name)}{ext}"
-        path = out_dir / fname
-        with open(path, "wb") as f:
-            f.write(data)
-        return str(path.name), len(data)
-
-    # 1) Scarica tutti i link di download HD noti nel sorgente
-    #    Cerca di mapparli ai colori usando fid1/id
-    id_to_link = meta.get("id_to_link", {})
+    skip_codes = set(skip_codes or ())
+
+    def add(rec: dict):
+        saved.append(rec)
+        if on_item:
+            on_item(rec)
+
+    def color_done(color: dict | None, base: str) -> bool:
+        if color:
+            return (color.get("code") or color.get("name")) in skip_codes
+        # download non associato a un colore: la chiave è il nome file
+        return any(k.startswith(f"{filename_sanitize(base)}.") for k in skip_codes)
+
+    # i download vanno in streaming su un temporaneo (in out_dir, o nella cache se presente)
+    # e vengono rinominati/collegati al nome finale solo quando servono
+    if cache is not None:
+        fetch = cache.fetch
+    else:
+        tmp_dir = sink.tmp_dir if sink is not None else out_dir
+        fetch = lambda session, link: stream_download(session, link, tmp_dir)
+
+    def save(item: dict, base_name: str, keep: bool = False) -> dict:
+        fname = f"{filename_sanitize(base_name)}{item['ext']}"
+        if sink is not None:
+            sink.put_download(item, f"{Path(out_dir).name}/{fname}", keep=keep)
+        elif cache is None:
+            commit_download(item, out_dir / fname)
+        else:
+            cache.link_into(item, out_dir / fname)
+        rec = {"file": fname, "bytes": item["size"], "digest": item["sha256"]}
+        if cache is not None:
+            rec["cached"] = item["cached"]
+        return rec
+
+    # 1) Scarica tutti i link di download HD noti nel sorgente + quelli costruiti per ogni
+    #    fid1 degli swatch (in parallelo). Cerca di mapparli ai colori usando fid1/id
+    observed = meta.get("id_to_link", {})
+    id_to_link = resolve_hd_links(meta) if try_hd else {}
     colors = meta.get("colors") or []
     code_to_color = {}
     fid1_to_color = {}
@@ -200,21 +562,24 @@ def download_all_colors(url: str, meta: dict, out_dir: Path, try_hd: bool = True
         if c.get("fid1"):
             fid1_to_color[str(c["fid1"])] = c
 
+    def base_for(fid: str) -> str:
+        # Nome file: SKU - Nome (COD) oppure SKU - download-{fid}
+        color = fid1_to_color.get(str(fid))
+        if color:
+            base = f"{meta['sku']} - {color.get('name','Color')}"
+            if color.get('code'):
+                base += f" ({color['code']})"
+            return base
+        return f"{meta['sku']} - download-{fid}"
+
+    id_to_link = {fid: link for fid, link in id_to_link.items()
+                  if not color_done(fid1_to_color.get(str(fid)), base_for(fid))}
     used_ids = set()
-    for fid, link in id_to_link.items():
-        data = try_download(session, link) if try_hd else None
+    for fid, link, data in fetch_all(session, id_to_link, fetch=fetch):
         if data:
             used_ids.add(fid)
-            color = fid1_to_color.get(str(fid))
-            # Nome file: SKU - Nome (COD) oppure SKU - download-{fid}
-            if color:
-                base = f"{meta['sku']} - {color.get('name','Color')}"
-                if color.get('code'):
-                    base += f" ({color['code']})"
-            else:
-                base = f"{meta['sku']} - download-{fid}"
-            fname, size = save_image_bytes(data, base)
-            saved.append({"method": "product_photo_download", "file": fname, "bytes": size, "url": link, "color": color})
+            add({"method": "product_photo_download", **save(data, base_for(fid)), "url": link,
+                 "color": fid1_to_color.get(str(fid)), "source": "html" if fid in observed else "template"})
 
     # 2) Per colori senza file, prova fallback: main image + thumbs (ingrandite)
     remaining = []
@@ -223,11 +588,12 @@ def download_all_colors(url: str, meta: dict, out_dir: Path, try_hd: bool = True
             # Se non abbiamo già un file con questo codice colore
             code = c.get("code")
             already = any((rec.get("color") or {}).get("code")==code for rec in saved if rec.get("color"))
-            if not already:
+            if not already and not color_done(c, ""):
                 remaining.append(c)
     else:
         # se non ci sono colori, trattiamo un singolo "default"
         remaining = [{"name": meta.get("current_color",{}).get("name") or "Default", "code": meta.get("current_color",{}).get("code")}]
+        remaining = [c for c in remaining if not color_done(c, "")]
 
     # Candidati immagine dalla pagina
     candidates = []
@@ -238,28 +604,35 @@ def download_all_colors(url: str, meta: dict, out_dir: Path, try_hd: bool = True
     # deduplicate mantenendo ordine
     seen = set(); candidates = [c for c in candidates if not (c in seen or seen.add(c))]
 
+    # Cache per-URL: ogni candidato viene sondato una sola volta per prodotto (in parallelo,
+    # HEAD + GET parziale), solo il vincitore viene scaricato per intero e poi assegnato
+    # a tutti i colori rimasti.
+    probes = probe_candidates(session, candidates) if remaining else {}
+    best_src = best_data = None
+    ranked = sorted((probes[c] for c in candidates if probes.get(c, {}).get("ok")), key=rank_key, reverse=True)
+    for entry in ranked:
+        data = fetch(session, entry["url"])
+        if data:
+            best_src, best_data = entry["url"], data
+            break
+
     for c in remaining:
-        best = None; best_src = None
-        for cand in candidates:
-            data = try_download(session, cand)
-            if data and (best is None or len(data) > len(best)):
-                best, best_src = data, cand
-        if best:
+        if best_src:
             base = f"{meta['sku']} - {c.get('name') or 'Color'}"
             if c.get("code"):
                 base += f" ({c['code']})"
-            fname, size = save_image_bytes(best, base)
-            saved.append({"method": "main/thumbs_fallback", "file": fname, "bytes": size, "url": best_src, "color": c})
+            add({"method": "main/thumbs_fallback", **save(best_data, base, keep=True), "url": best_src, "color": c})
         else:
-            saved.append({"method": "failed", "color": c, "reason": "no image candidates downloadable"})
+            add({"method": "failed", "color": c, "reason": "no image candidates downloadable"})
+    if best_data and cache is None:
+        discard_download(best_data)  # temporaneo ancora presente se il sink è un archivio
 
     # 3) Se ancora nulla salvato, tenta almeno la main image se esiste
-    if not saved and meta.get("main_img"):
-        data = try_download(session, meta["main_img"])
+    if not saved and not skip_codes and meta.get("main_img"):
+        data = fetch(session, meta["main_img"])
         if data:
             base = f"{meta['sku']} - default"
-            fname, size = save_image_bytes(data, base)
-            saved.append({"method": "last_resort_main", "file": fname, "bytes": size, "url": meta["main_img"], "color": None})
+            add({"method": "last_resort_main", **save(data, base), "url": meta["main_img"], "color": None})
 
     return saved
 
@@ -267,3 +640,131 @@ def scrape_product_page(url: str) -> dict:
     with _session() as s:
         meta, _soup = parse_page(s, url)
         return meta
+
+
+BATCH_WORKERS = 4
+
+def process_product(session: requests.Session, url: str, out_root: Path, try_hd: bool = True, cache=None,
+                    manifest=None, fingerprints=None, dedup=None, fast_parse: bool = False, sink=None,
+                    postprocess=None) -> dict:
+    """
+    Parse + download di un prodotto con una sessione condivisa (la pagina viene scaricata una volta sola).
+    Con `manifest` (manifest.JobManifest) i colori già completati vengono saltati e ogni
+    risultato viene registrato appena pronto. Con `fingerprints` (fingerprints.FingerprintStore)
+    la pagina si chiede in modo condizionale e si scaricano solo i colori nuovi o cambiati.
+    Con `dedup` (True, o un dedup.PhashIndex per i duplicati fra SKU) i record vengono
+    annotati con digest/dHash e duplicati (vedi `dedup.annotate_duplicates`).
+    `fast_parse` usa l'estrattore lxml/XPath invece di BeautifulSoup (stesso meta).
+    `sink`: un sink (sinks.py) condiviso, oppure una factory `sink(sku)` per un archivio per
+    SKU, chiuso a fine prodotto. Con un archivio il dedup si salta (servono i file su disco).
+    Con `postprocess` (postprocess.Postprocessor) ogni immagine va al pool di rendition appena
+    salvata; i Future sono in `result["_postprocess"]` (scrape_batch li attende prima di restituire).
+    """
+    product_sink = None
+    try:
+        prev = fingerprints.get(url) if fingerprints else {}
+        # scorciatoie (304 / stessa impronta) solo se il run precedente aveva completato tutto
+        complete = bool(prev.get("complete"))
+        html, etag, last_modified = fetch_page(session, url, prev.get("etag") if complete else None,
+                                               prev.get("last_modified") if complete else None)
+        if html is None:
+            return {"url": url, "sku": prev.get("sku"), "unchanged": True, "saved": []}
+        meta, _doc = parse_page(session, url, html=html, fast=fast_parse)
+        if complete and prev.get("fingerprint") == meta["fingerprint"]:
+            fingerprints.update(url, meta, meta["color_fingerprints"], etag, last_modified)
+            return {"url": url, "sku": meta["sku"], "unchanged": True, "meta": meta, "saved": []}
+        out_dir = Path(out_root) / meta["sku"]
+        if sink is not None and not hasattr(sink, "put_download"):
+            sink = product_sink = sink(meta["sku"])
+        if sink is None:
+            out_dir.mkdir(parents=True, exist_ok=True)
+        skip = set(manifest.done_colors(url)) if manifest else set()
+        # colori con la stessa impronta del run precedente: niente download
+        old_fps = prev.get("colors") or {}
+        skip |= {k for k, fp in meta["color_fingerprints"].items() if old_fps.get(k) == fp}
+        pending = []
+        use_pp = postprocess is not None and not getattr(sink, "archive", False)
+
+        def on_item(rec: dict):
+            if manifest:
+                manifest.record_color(url, meta["sku"], rec, out_dir)
+            if use_pp:
+                try:
+                    fut = postprocess.submit(rec, out_dir)
+                except BrokenProcessPool as e:
+                    # pool morto (es. worker ucciso dall'OOM): l'originale resta, senza rendition
+                    rec["renditions_error"] = f"{type(e).__name__}: {e}"
+                    fut = None
+                if fut is not None:
+                    pending.append(fut)
+        saved = download_all_colors(url, meta, out_dir, try_hd=try_hd, session=session, cache=cache,
+                                    skip_codes=skip, on_item=on_item, sink=sink)
+        if dedup and not getattr(sink, "archive", False):
+            from dedup import annotate_duplicates  # numpy/Pillow solo se serve
+            annotate_duplicates(saved, out_dir, sku=meta["sku"], index=None if dedup is True else dedup)
+        failed = {k for k in (color_key(rec) for rec in saved if rec.get("method") == "failed") if k}
+        if manifest:
+            manifest.record_product(url, "partial" if failed else "done", sku=meta["sku"])
+        if fingerprints:
+            # i colori falliti non vengono memorizzati: il prossimo refresh li ritenta
+            fingerprints.update(url, meta, {k: fp for k, fp in meta["color_fingerprints"].items() if k not in failed},
+                                etag, last_modified, complete=not failed)
+        res = {"url": url, "sku": meta["sku"], "out_dir": str(out_dir), "meta": meta, "saved": saved}
+        if use_pp:
+            res["_postprocess"] = pending
+        return res
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if manifest:
+            manifest.record_product(url, "error", error=error)
+        return {"url": url, "error": error}
+    finally:
+        if product_sink is not None:
+            product_sink.close()
+
+def scrape_batch(urls, out_root: Path, try_hd: bool = True, max_workers: int = BATCH_WORKERS,
+                 session: requests.Session | None = None, auth_state: Path | None = AUTH_STATE, cache=None,
+                 manifest=None, fingerprints=None, dedup=None, fast_parse: bool = False, sink=None,
+                 postprocess=None):
+    """
+    Elabora molti prodotti in parallelo su un'unica sessione con connection pool.
+    `urls` può essere un qualunque iterabile (anche un generatore): viene consumato
+    man mano, e i risultati vengono restituiti appena pronti (ordine di completamento).
+    Con `manifest` il job è riprendibile: i prodotti già completati vengono saltati.
+    Con `fingerprints` è un refresh incrementale: si lavora solo sul delta.
+    Con `dedup` i duplicati vengono segnalati per prodotto (e fra SKU se è un PhashIndex).
+    Con `sink` (sinks.py, thread-safe) le immagini finiscono ad es. in un unico ZIP del batch.
+    Con `postprocess` le rendition girano in un pool di processi mentre i download proseguono;
+    un risultato viene restituito quando anche le sue rendition sono pronte.
+    """
+    if manifest is not None:
+        urls = manifest.pending(urls)
+    own_session = session is None
+    if own_session:
+        # ogni prodotto può avere fino a PROBE_WORKERS richieste in volo
+        session = _session(pool_size=max_workers * (PROBE_WORKERS + 1))
+        if auth_state:
+            load_auth_cookies(session, auth_state)
+    def finish(res: dict) -> dict:
+        # attesa delle rendition solo qui, lato consumatore: i worker di I/O non si fermano
+        futs = res.pop("_postprocess", None)
+        if futs:
+            wait(futs)
+        return res
+
+    opts = dict(try_hd=try_hd, cache=cache, manifest=manifest, fingerprints=fingerprints, dedup=dedup,
+                fast_parse=fast_parse, sink=sink, postprocess=postprocess)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            pending = set()
+            for url in urls:
+                pending.add(ex.submit(process_product, session, url, out_root, **opts))
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        yield finish(fut.result())
+            for fut in as_completed(pending):
+                yield finish(fut.result())
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,172 @@
+# sinks.py
+# Destinazioni di output per le immagini scaricate. I nomi sono relativi ("SKU/file.jpg"):
+# - Sink: interfaccia comune (abc), usata da scraper/browser_scraper tramite put_*
+# - DirSink: file su disco sotto `root` (rename atomico del temporaneo, hardlink per i blob di cache)
+# - ZipSink / TarSink: archivio scritto man mano che le immagini finiscono, senza passare
+#   da out_dir; funzionano anche su stream non seekable (pipe, risposta HTTP in streaming),
+#   così un front end può iniziare a inviare l'archivio prima della fine del batch.
+# JPEG/PNG/WebP sono già compressi: nello ZIP vanno in modalità STORED.
+
+from pathlib import Path
+import abc, io, os, tarfile, tempfile, threading, time, zipfile
+
+from scraper import commit_download, copy_atomic
+
+STORED_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".avif"}
+
+class Sink(abc.ABC):
+    """Interfaccia comune dei sink: nomi relativi, `tmp_dir` per i download temporanei."""
+    archive = False
+    tmp_dir: Path
+
+    @abc.abstractmethod
+    def put_file(self, name: str, src: Path, move: bool = False) -> str: ...
+
+    @abc.abstractmethod
+    def put_bytes(self, name: str, data: bytes) -> str: ...
+
+    @abc.abstractmethod
+    def put_download(self, info: dict, name: str, keep: bool = False) -> str:
+        """Salva un download di `stream_download` / `ImageCache.fetch`."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DirSink(Sink):
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.tmp_dir = self.root  # stesso filesystem: i temporanei si rinominano e basta
+
+    def _dest(self, name: str) -> Path:
+        dest = self.root / name
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        return dest
+
+    def put_file(self, name: str, src: Path, move: bool = False) -> str:
+        dest = self._dest(name)
+        if move:
+            os.replace(src, dest)
+        else:
+            copy_atomic(src, dest)
+        return name
+
+    def put_bytes(self, name: str, data: bytes) -> str:
+        dest = self._dest(name)
+        fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=".dl-", suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dest)
+        return name
+
+    def put_download(self, info: dict, name: str, keep: bool = False) -> str:
+        """Vedi `commit_download`; i blob della cache diventano hardlink (copia come ripiego)."""
+        dest = self._dest(name)
+        if "cached" in info:
+            try:
+                if dest.exists():
+                    if os.path.samefile(info["path"], dest):
+                        return name
+                    dest.unlink()
+                os.link(info["path"], dest)
+            except OSError:
+                copy_atomic(info["path"], dest)
+        else:
+            commit_download(info, dest)
+        return name
+
+class _ArchiveSink(Sink):
+    """Base degli archivi append-only: le sottoclassi scrivono una voce con `_add`."""
+    archive = True
+
+    def __init__(self, tmp_dir: Path = None):
+        self.tmp_dir = Path(tmp_dir or tempfile.gettempdir())
+        self._lock = threading.Lock()
+        self._names = set()
+
+    @abc.abstractmethod
+    def _add(self, name: str, src: Path = None, data: bytes = None):
+        """Scrive una voce (da file o da bytes); chiamata con `_lock` già preso."""
+
+    def put_file(self, name: str, src: Path, move: bool = False) -> str:
+        with self._lock:
+            # un nome già presente non viene riscritto (l'archivio è append-only)
+            if name not in self._names:
+                self._add(name, src=Path(src))
+                self._names.add(name)
+        if move:
+            os.unlink(src)
+        return name
+
+    def put_bytes(self, name: str, data: bytes) -> str:
+        with self._lock:
+            if name not in self._names:
+                self._add(name, data=data)
+                self._names.add(name)
+        return name
+
+    def put_download(self, info: dict, name: str, keep: bool = False) -> str:
+        """
+        Scrive nell'archivio un download. Il temporaneo viene eliminato subito, salvo
+        `keep=True` (stessa immagine per più colori: poi `scraper.discard_download`).
+        """
+        owned = not info.get("path")
+        return self.put_file(name, info.get("path") or info["tmp"], move=owned and not keep)
+
+class ZipSink(_ArchiveSink):
+    def __init__(self, target, tmp_dir: Path = None):
+        """`target`: path dell'archivio o file object aperto in scrittura (anche non seekable)."""
+        super().__init__(tmp_dir)
+        self._zf = zipfile.ZipFile(target, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def _add(self, name: str, src: Path = None, data: bytes = None):
+        compress = zipfile.ZIP_STORED if Path(name).suffix.lower() in STORED_EXTS else zipfile.ZIP_DEFLATED
+        if src is not None:
+            self._zf.write(src, name, compress_type=compress)
+        else:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.external_attr = 0o644 << 16
+            self._zf.writestr(info, data, compress_type=compress)
+
+    def close(self):
+        with self._lock:
+            self._zf.close()
+
+class TarSink(_ArchiveSink):
+    def __init__(self, target, tmp_dir: Path = None):
+        """`target`: path dell'archivio o file object; scrittura in modalità stream (`w|`)."""
+        super().__init__(tmp_dir)
+        if isinstance(target, (str, Path)):
+            self._tf = tarfile.open(str(target), "w|")
+        else:
+            self._tf = tarfile.open(fileobj=target, mode="w|")
+
+    def _add(self, name: str, src: Path = None, data: bytes = None):
+        ti = tarfile.TarInfo(name)
+        ti.mode = 0o644
+        if src is not None:
+            st = src.stat()
+            ti.size, ti.mtime = st.st_size, int(st.st_mtime)
+            with open(src, "rb") as f:
+                self._tf.addfile(ti, f)
+        else:
+            ti.size, ti.mtime = len(data), int(time.time())
+            self._tf.addfile(ti, io.BytesIO(data))
+
+    def close(self):
+        with self._lock:
+            self._tf.close()
+
+def open_sink(target, kind: str = None, tmp_dir: Path = None):
+    """Sink da un path: ".zip" -> ZipSink, ".tar" -> TarSink, altrimenti DirSink (cartella)."""
+    kind = kind or Path(str(target)).suffix.lower().lstrip(".")
+    if kind == "zip":
+        return ZipSink(target, tmp_dir)
+    if kind == "tar":
+        return TarSink(target, tmp_dir)
+    return DirSink(target)
@@ -0,0 +1,33 @@
+# Duplicati in un prodotto: byte identici fra colori diversi -> suspect; foto ricolorata
+# di un altro colore -> solo similar_to.
+
+import shutil, sys
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dedup import annotate_duplicates
+
+def _garment(path: Path, rgb: tuple[int, int, int]):
+    # stesso soggetto (gradiente + rettangolo), colore diverso: dHash quasi uguale
+    x = np.linspace(0.3, 1.0, 128)[None, :, None]
+    img = np.ones((128, 128, 3)) * x * np.array(rgb)
+    img[40:90, 30:70] *= 0.5
+    Image.fromarray(img.astype(np.uint8)).save(path, quality=95)
+
+def test_exact_duplicates_are_suspect_and_recolours_are_informational(tmp_path):
+    _garment(tmp_path / "BLK.jpg", (60, 60, 60))
+    _garment(tmp_path / "RED.jpg", (220, 30, 30))  # fallback: stessa immagine per RED e WHT
+    shutil.copyfile(tmp_path / "RED.jpg", tmp_path / "WHT.jpg")
+    saved = [{"file": f"{c}.jpg", "color": {"code": c}} for c in ("BLK", "RED", "WHT")]
+
+    annotate_duplicates(saved, tmp_path)
+    blk, red, wht = saved
+
+    assert wht["duplicate_of"] == "RED.jpg" and wht["duplicate_kind"] == "exact"
+    assert red.get("suspect") and wht.get("suspect")
+    assert "duplicate_of" not in red and not blk.get("suspect")
+    assert red["similar_to"] == ["BLK.jpg"]
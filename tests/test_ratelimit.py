@@ -0,0 +1,58 @@
+# Risposte stream=True: il posto per host si libera anche leggendo il body o col GC,
+# non solo con close(); con limit=1 la richiesta successiva altrimenti resta bloccata.
+
+import gc, sys, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ratelimit import ControlledSession, RateController
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b"x" * 100_000
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def url():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_port}/"
+    srv.shutdown()
+    srv.server_close()
+
+def _content(r):
+    r.content
+
+def _iter_content(r):
+    for _ in r.iter_content(8192):
+        pass
+
+@pytest.mark.parametrize("consume", [_content, _iter_content, None])
+def test_stream_slot_released(url, consume):
+    controller = RateController(initial=1, max_limit=1)
+    session = ControlledSession(controller)
+
+    def run():
+        r = session.get(url, stream=True)
+        if consume:
+            consume(r)  # `r` resta vivo: il posto deve liberarsi a fine body
+        else:
+            del r
+            gc.collect()
+        session.get(url)
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    t.join(10)
+    assert not t.is_alive()
+    assert controller.stats()[url.split("/")[2]]["in_flight"] == 0